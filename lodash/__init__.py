@@ -1,17 +1,19 @@
-from .string_manipulation import snake_to_camel, camel_to_snake, indent, dedent, snake_to_human, extract_domain, convert_links_in_text_to_html, truncate_string, remove_quotes, split_keypath, match_keypath
-from .array_manipulation import arguments_to_string, colorized_arguments_to_string, compact, compact_blank, uniq, flatten, fetch_element, get_element, split_options, wrap
-from .dict_manipulation import dig, digwrite, cut_up_values, to_path, dump_json_with_index_comments, fetch, truncate_fields_from_focused_out_fields, format_dict_to_markdown
+from .string_manipulation import snake_to_camel, camel_to_snake, indent, dedent, snake_to_human, extract_domain, convert_links_in_text_to_html, truncate_string, remove_quotes, split_keypath, match_keypath, match_keypaths, compile_keypath_template, KeyPathTemplate
+from .array_manipulation import arguments_to_string, colorized_arguments_to_string, compact, compact_blank, uniq, uniq_by, iuniq, flatten, iflatten, fetch_element, get_element, split_options, wrap
+from .dict_manipulation import dig, dig_many, compile_extractor, digwrite, digwrite_many, compile_path, cut_up_values, to_path, dump_json_with_index_comments, fetch, truncate_fields_from_focused_out_fields, format_dict_to_markdown
 from .load_all import load_all
 from .get_user_choice import get_user_choice
 from .chaining import chaining
 from .remove_duplication import remove_duplication
 from .mute_method import mute_method_unless
 from .typing_ext import is_method, isnt_method, is_subclass, is_instance, type_to_str
-from .tokens import calculate_tokens_for, calculate_tokens_for_string, maximum_context_tokens
-from .cache import ttl_cache
+from .tokens import calculate_tokens_for, calculate_tokens_for_many, calculate_tokens_for_string, maximum_context_tokens, warm_up_encodings, count_streaming_tokens, StreamingTokenCounter, fit_to_token_budget
+from .cache import ttl_cache, CacheStats, add_cache_hook, remove_cache_hook, registered_caches, cache_stats_snapshot
+from .cache_store import SQLiteStore, UnstableKeyError
 from .lang import language_detect
 from .llm_args import print_debug_start, print_debug_end
-from .dict_sha import dict_to_sha256
+from .dict_sha import dict_to_sha256, MerkleHasher
+from .tree_walker import walk, iter_containers, transform
 from .data_schema_parser import data_schema_parser
 from .gremlin_error_messages import GREMLIN_ERROR_MESSAGES, get_random_gremlin_error_message
 from .env_manipulation import set_env
@@ -28,10 +30,20 @@ __all__ = [
     "is_subclass",
     "is_instance",
     "ttl_cache",
+    "CacheStats",
+    "add_cache_hook",
+    "remove_cache_hook",
+    "registered_caches",
+    "cache_stats_snapshot",
+    "SQLiteStore",
+    "UnstableKeyError",
     "compact_blank",
     "type_to_str",
     "uniq",
+    "uniq_by",
+    "iuniq",
     "flatten",
+    "iflatten",
     "remove_duplication",
     "truncate_string",
     "remove_quotes",
@@ -41,6 +53,9 @@ __all__ = [
     "snake_to_human",
     "split_keypath",
     "match_keypath",
+    "match_keypaths",
+    "compile_keypath_template",
+    "KeyPathTemplate",
     "indent",
     "extract_domain",
     "convert_links_in_text_to_html",
@@ -57,16 +72,29 @@ __all__ = [
     "is_method",
     "isnt_method",
     "calculate_tokens_for",
+    "calculate_tokens_for_many",
     "calculate_tokens_for_string",
     "maximum_context_tokens",
+    "warm_up_encodings",
+    "count_streaming_tokens",
+    "StreamingTokenCounter",
+    "fit_to_token_budget",
     "language_detect",
     "print_debug_start",
     "print_debug_end",
     "dig",
+    "dig_many",
+    "compile_extractor",
     "digwrite",
+    "digwrite_many",
     "cut_up_values",
     "dict_to_sha256",
+    "MerkleHasher",
+    "walk",
+    "iter_containers",
+    "transform",
     "to_path",
+    "compile_path",
     "data_schema_parser",
     "GREMLIN_ERROR_MESSAGES",
     "get_random_gremlin_error_message",
@@ -1,6 +1,8 @@
 import re
+from collections import OrderedDict
 from colorist import BrightColor
-from typing import Callable, TypeVar, Any
+from typing import Callable, TypeVar, Any, Iterable, Iterator
+from .dict_sha import freeze
 from .string_manipulation import truncate_string
 
 def get_element(a: list[Any], i: int) -> Any:
@@ -51,22 +53,34 @@ def arguments_to_string(*args, **kwds):
     to_join = [str for str in to_join if str]
     return ", ".join(to_join)
 
-def flatten(a: list[Any], level: int | None = None) -> list[Any]:
-    result = []
+_ATOMIC_ITERABLES = (str, bytes, bytearray, dict)
 
-    def _flatten_recursive(lst, curr_level):
-        nonlocal level
-        for item in lst:
-            if isinstance(item, list):
-                if level is None or curr_level < level:
-                    _flatten_recursive(item, curr_level + 1)
-                else:
-                    result.append(item)
-            else:
-                result.append(item)
 
-    _flatten_recursive(a, 0)
-    return result
+def iflatten(a: Iterable[Any], level: int | None = None, types: type | tuple[type, ...] = list) -> Iterator[Any]:
+    """
+    Lazily yields the items of `a` with nested lists flattened, `level` levels deep (all by default).
+
+    Uses an explicit stack, so arbitrarily deep nesting doesn't hit the recursion limit.
+    With `types`, e.g. `(list, tuple)` or `collections.abc.Iterable`, other iterables are
+    flattened too; strings, bytes and dicts never are.
+
+    Example:
+        list(iflatten([1, [2, [3, (4,)]]], level=1, types=(list, tuple)))  # [1, 2, [3, (4,)]]
+    """
+    stack = [iter(a)]
+    while stack:
+        for item in stack[-1]:
+            if isinstance(item, types) and not isinstance(item, _ATOMIC_ITERABLES) \
+                    and (level is None or len(stack) <= level):
+                stack.append(iter(item))
+                break
+            yield item
+        else:
+            stack.pop()
+
+
+def flatten(a: list[Any], level: int | None = None, types: type | tuple[type, ...] = list) -> list[Any]:
+    return list(iflatten(a, level, types))
 
 CMP = TypeVar('CMP', dict, list)
 
@@ -109,7 +123,57 @@ def compact_blank(a: CMP) -> CMP:
 
 
 T = TypeVar('T')
-def uniq(a: list[T], l: Callable[[T, T], bool] = lambda x, y: x == y) -> list[T]:
+def iuniq(a: Iterable[T], key: Callable[[T], Any] | None = None, max_seen: int | None = None) -> Iterator[T]:
+    """
+    Lazily yields the unique elements of the iterable `a`, keeping the first of duplicates.
+
+    Elements (or their `key`s) are deduplicated by hash; dicts, lists and sets are frozen
+    (see `lodash.dict_sha.freeze`), so they dedupe in linear time too. Values which still
+    can't be hashed are compared with `==` to the unhashable ones seen before.
+
+    Parameters:
+    - `a` (Iterable[T]): The input iterable, which is consumed lazily.
+    - `key` (Callable[[T], Any]): The value by which elements are compared, the element itself by default.
+    - `max_seen` (int): Bounds the memory by remembering only the most recently seen keys;
+          duplicates further apart than that are yielded again.
+
+    Returns:
+    - Iterator[T]: The unique elements in their original order.
+    """
+    bounded = max_seen is not None
+    seen: OrderedDict | set = OrderedDict() if bounded else set()
+    unhashable = []
+    for elem in a:
+        value = elem if key is None else key(elem)
+        # hashed up front: `in` on a set accepts an unhashable set argument, but `add` doesn't
+        try:
+            hash(value)
+        except TypeError:
+            # a set equals the frozenset of its items, and those are hashable
+            value = frozenset(value) if isinstance(value, set) else freeze(value)
+            try:
+                hash(value)
+            except TypeError:
+                if any(value == existing for existing in unhashable):
+                    continue
+                unhashable.append(value)
+                if bounded and len(unhashable) > max_seen:
+                    del unhashable[0]
+                yield elem
+                continue
+        if value not in seen:
+            if bounded:
+                seen[value] = None
+                if len(seen) > max_seen:
+                    seen.popitem(last=False)
+            else:
+                seen.add(value)
+            yield elem
+        elif bounded:
+            seen.move_to_end(value)
+
+
+def uniq(a: list[T], l: Callable[[T, T], bool] | None = None, key: Callable[[T], Any] | None = None) -> list[T]:
     """
     Returns a new list containing only the unique elements from the input list `a`.
 
@@ -117,17 +181,35 @@ def uniq(a: list[T], l: Callable[[T, T], bool] = lambda x, y: x == y) -> list[T]
     - `a` (list[T]): The input list from which to extract the unique elements.
     - `l` (Callable[[T, T], bool]): A function that compares two elements of
           type T and returns True if they are equal, and False otherwise.
-          By default, it uses the `==` operator for comparison.
+          Elements are then compared pairwise, which takes quadratic time.
+          By default, elements are compared by hash, which is equivalent to `==`, see `iuniq`.
+    - `key` (Callable[[T], Any]): Compares elements by `key(element)` instead.
 
     Returns:
     - list[T]: A new list containing only the unique elements from the input list `a`.
     """
+    if l is None:
+        return list(iuniq(a, key))
+
     result = []
+    kept = []
     for elem in a:
-        if not any(l(elem, existing) for existing in result):
+        value = elem if key is None else key(elem)
+        if not any(l(value, existing) for existing in kept):
             result.append(elem)
+            kept.append(value)
     return result
 
+
+def uniq_by(a: list[T], key: Callable[[T], Any]) -> list[T]:
+    """
+    Returns the elements of `a` with unique `key(element)`, keeping the first of duplicates.
+
+    Example:
+        uniq_by(users, lambda user: user["email"].lower())
+    """
+    return list(iuniq(a, key))
+
 def wrap(a) -> list:
     if a is None:
         return []
@@ -181,3 +263,18 @@ if __name__ == '__main__':
     assert compact([1, 2, None, '3', '']) == [1, 2, '3', '']
     assert compact_blank([1, 2, '', 3]) == [1, 2, 3]
     assert compact_blank({'a': 1, 'b': 2, 'c': '', 'd': 3, 'e': None}) == {'a': 1, 'b': 2, 'd': 3}
+    assert uniq([1, 2, 1, 3, 2]) == [1, 2, 3]
+    assert uniq([{'a': [1]}, {'a': [1]}, [1], (1,), [1]]) == [{'a': [1]}, [1], (1,)]
+    assert uniq(['a', 'B', 'b'], lambda x, y: x.lower() == y.lower()) == ['a', 'B']
+    assert uniq_by([{'id': 1, 'v': 1}, {'id': 1, 'v': 2}, {'id': 2}], lambda x: x['id']) == [{'id': 1, 'v': 1}, {'id': 2}]
+    assert list(iuniq(iter([1, 2, 1, 3, 1]), max_seen=1)) == [1, 2, 1, 3, 1]
+    assert list(iuniq([1, 2, 1, 3, 2], max_seen=2)) == [1, 2, 3, 2]
+    assert uniq([{1, 2}, {2, 1}, frozenset({1, 2}), [{1}], [{1}]]) == [{1, 2}, [{1}]]
+    assert uniq_by([{'tags': {'a'}}, {'tags': {'a'}}, {'tags': {'b'}}], lambda x: x['tags']) == [{'tags': {'a'}}, {'tags': {'b'}}]
+    assert flatten([1, [2, [3, [4]]], []]) == [1, 2, 3, 4]
+    assert flatten([1, [2, [3, [4]]]], level=1) == [1, 2, [3, [4]]]
+    assert flatten([1, (2, [3]), 'ab'], types=(list, tuple)) == [1, 2, 3, 'ab']
+    deep = []
+    for _ in range(10000):
+        deep = [deep, 1]
+    assert flatten(deep) == [1] * 10000
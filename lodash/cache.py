@@ -1,29 +1,587 @@
+import asyncio
+import heapq
+import inspect
+import logging
+import random
+import threading
 import time
-from math import floor
-from typing import Callable, Any
-from functools import lru_cache, update_wrapper
-from typing import Callable
+import weakref
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+from functools import update_wrapper
+from itertools import count
+from typing import Any, Callable, Hashable, Iterable
+from lodash.cache_store import SQLiteStore
+from lodash.dict_sha import freeze
 
-def ttl_cache(maxsize: int = 128, typed: bool = False, ttl: int = 60 * 60):
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+CacheHook = Callable[[str, str, Any, float | None], None]
+
+_hooks: tuple[CacheHook, ...] = ()
+_registry: "weakref.WeakSet[TTLCache]" = weakref.WeakSet()
+_registry_lock = threading.Lock()
+_logger = logging.getLogger(__name__)
+
+
+class _KwargsMark:
+    # has a stable repr, so keys can be digested for a persistent store
+    __slots__ = ()
+    _stable_repr = True
+
+    def __repr__(self):
+        return "<kwargs>"
+
+
+_MISSING = object()
+_KWARGS_MARK = _KwargsMark()
+
+
+class _Flight:
+    __slots__ = ("future", "owner")
+
+    def __init__(self):
+        self.future = Future()
+        self.owner = threading.get_ident()
+
+
+class _CachedFailure:
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _retrieve_exception(task: asyncio.Task) -> None:
+    # keeps asyncio from logging failures of tasks whose awaiters were all cancelled
+    if not task.cancelled():
+        task.exception()
+
+
+class CacheStats:
+    """
+    Counters of a `TTLCache`. Every lookup which isn't a hit ends as exactly one of a miss
+    (the function was computed, its latency is in `miss_time`), a store hit (the value was
+    loaded from the persistent store, in `store_time`) or a failure (the function raised).
+    """
+    __slots__ = (
+        "hits", "misses", "store_hits", "failures", "evictions", "expirations",
+        "miss_time", "max_miss_time", "store_time"
+    )
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.hits = self.misses = self.store_hits = self.failures = 0
+        self.evictions = self.expirations = 0
+        self.miss_time = self.max_miss_time = self.store_time = 0.0
+
+    def copy(self) -> "CacheStats":
+        stats = CacheStats()
+        for name in self.__slots__:
+            setattr(stats, name, getattr(self, name))
+        return stats
+
+    @property
+    def lookups(self) -> int:
+        return self.hits + self.misses + self.store_hits + self.failures
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    @property
+    def average_miss_time(self) -> float:
+        return self.miss_time / self.misses if self.misses else 0.0
+
+    @property
+    def time_saved(self) -> float:
+        """An estimate in seconds: every hit or store hit would have cost an average miss."""
+        return (self.hits + self.store_hits) * self.average_miss_time - self.store_time
+
+    def as_dict(self) -> dict[str, int | float]:
+        stats = {name: getattr(self, name) for name in self.__slots__}
+        stats.update(
+            lookups=self.lookups,
+            hit_rate=self.hit_rate,
+            average_miss_time=self.average_miss_time,
+            time_saved=self.time_saved
+        )
+        return stats
+
+    def __repr__(self):
+        return f"CacheStats({', '.join(f'{name}={getattr(self, name)}' for name in self.__slots__)})"
+
+
+def add_cache_hook(hook: CacheHook) -> None:
+    """
+    Calls `hook(event, cache_name, key, duration)` on every cache event of every `TTLCache`.
+    Events are "hit", "miss", "store_hit", "failure" (with the duration of the computation or
+    the load in seconds), "eviction" and "expiration" (with None). Hooks are called outside
+    of the cache lock, in the thread which caused the event; exceptions they raise are logged.
+
+    Example:
+        add_cache_hook(lambda event, name, key, duration: counter.labels(name, event).inc())
+    """
+    global _hooks
+    with _registry_lock:
+        _hooks = _hooks + (hook,)
+
+
+def remove_cache_hook(hook: CacheHook) -> None:
+    global _hooks
+    with _registry_lock:
+        _hooks = tuple(registered for registered in _hooks if registered is not hook)
+
+
+def registered_caches() -> list["TTLCache"]:
+    """All live `TTLCache`s, including the ones behind `ttl_cache` functions."""
+    with _registry_lock:
+        return list(_registry)
+
+
+def cache_stats_snapshot() -> dict[str, dict[str, Any]]:
+    """
+    The stats of every live cache by its name, with its size and limits.
+    Caches with the same name get a "#2", "#3", ... suffix.
+    """
+    snapshot = {}
+    for cache in sorted(registered_caches(), key=lambda cache: cache.name):
+        name = cache.name
+        suffix = 1
+        while name in snapshot:
+            suffix += 1
+            name = f"{cache.name}#{suffix}"
+        snapshot[name] = cache.snapshot()
+    return snapshot
+
+
+class TTLCache:
+    """
+    A thread-safe LRU cache where every entry expires on its own.
+
+    Entries live for `ttl` seconds (shortened by up to `jitter` * `ttl` at random, so that
+    entries stored together don't expire together). Expired entries are dropped before
+    any live entry is evicted. `get_or_compute` and `aget_or_compute` are single-flight:
+    concurrent misses on the same key run the function once and share its result or
+    exception. Exceptions are only cached when `cache_failures` is set.
+
+    With a `store`, misses are looked up in it under `namespace` before computing, and
+    computed results are written to it, so they survive restarts.
+
+    Counters are kept in `stats` (see `CacheStats`), every cache is listed by
+    `registered_caches` under `name`, and events are passed to the hooks of `add_cache_hook`.
+    """
+
+    def __init__(
+            self,
+            maxsize: int | None = 128,
+            ttl: float = 60 * 60,
+            jitter: float = 0.0,
+            timer: Callable[[], float] = time.monotonic,
+            cache_failures: bool = False,
+            store: SQLiteStore | None = None,
+            namespace: str = "",
+            name: str | None = None
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.jitter = jitter
+        self.cache_failures = cache_failures
+        self.store = store
+        self.namespace = namespace
+        self.name = name or namespace or f"TTLCache@{id(self):x}"
+        self.stats = CacheStats()
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._data: OrderedDict[Any, tuple[Any, float]] = OrderedDict()
+        self._expiries: list[tuple[float, int, Any]] = []
+        self._counter = count()
+        self._in_flight: dict[Any, _Flight] = {}
+        self._in_flight_tasks: dict[Any, asyncio.Task] = {}
+        # events for the hooks, collected under the lock and emitted after it
+        self._events: list[tuple[str, Any, float | None]] = []
+        with _registry_lock:
+            _registry.add(self)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _entry_ttl(self) -> float:
+        if self.jitter:
+            return self.ttl * (1 - random.random() * self.jitter)
+        return self.ttl
+
+    def _event(self, event: str, key, duration: float | None = None) -> None:
+        # called under the lock; without hooks, nothing is collected
+        if _hooks:
+            self._events.append((event, key, duration))
+
+    def _emit_events(self) -> None:
+        with self._lock:
+            events, self._events = self._events, []
+        for event, key, duration in events:
+            for hook in _hooks:
+                try:
+                    hook(event, self.name, key, duration)
+                except Exception:
+                    _logger.exception("Cache hook %r failed on %s", hook, event)
+
+    def _lookup(self, key, now: float):
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        value, expires_at = entry
+        if expires_at <= now:
+            del self._data[key]
+            self.stats.expirations += 1
+            self._event("expiration", key)
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def _purge_expired(self, now: float) -> None:
+        expiries = self._expiries
+        while expiries and expiries[0][0] <= now:
+            expires_at, _, key = heapq.heappop(expiries)
+            entry = self._data.get(key)
+            if entry is not None and entry[1] == expires_at:
+                del self._data[key]
+                self.stats.expirations += 1
+                self._event("expiration", key)
+        if len(expiries) > 2 * len(self._data) + 16:
+            # entries which were overwritten or evicted leave stale expiries behind
+            self._expiries = [(expires_at, next(self._counter), key) for key, (_, expires_at) in self._data.items()]
+            heapq.heapify(self._expiries)
+
+    def _store(self, key, value, now: float, ttl: float | None = None) -> None:
+        if self.maxsize == 0:
+            return
+        expires_at = now + (self._entry_ttl() if ttl is None else min(ttl, self._entry_ttl()))
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        heapq.heappush(self._expiries, (expires_at, next(self._counter), key))
+        self._purge_expired(now)
+        if self.maxsize is not None:
+            while len(self._data) > self.maxsize:
+                evicted, _ = self._data.popitem(last=False)
+                self.stats.evictions += 1
+                self._event("eviction", evicted)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._lookup(key, self._timer())
+        if self._events:
+            self._emit_events()
+        return default if value is _MISSING or type(value) is _CachedFailure else value
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._store(key, value, self._timer())
+        if self._events:
+            self._emit_events()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._expiries.clear()
+            self.stats.reset()
+        if self.store is not None:
+            self.store.clear(self.namespace)
+
+    def _load(self, key) -> tuple[Any, float] | None:
+        # a stored value with its remaining lifetime
+        entry = self.store.get_entry(key, self.namespace)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        return value, expires_at - time.time()
+
+    def _persist(self, key, value) -> None:
+        self.store.set(key, value, self.ttl, self.namespace)
+
+    def _record_outcome(self, key, loaded: bool, failed: bool, duration: float) -> None:
+        # called under the lock once a miss is resolved
+        stats = self.stats
+        if failed:
+            stats.failures += 1
+            self._event("failure", key, duration)
+        elif loaded:
+            stats.store_hits += 1
+            stats.store_time += duration
+            self._event("store_hit", key, duration)
+        else:
+            stats.misses += 1
+            stats.miss_time += duration
+            if duration > stats.max_miss_time:
+                stats.max_miss_time = duration
+            self._event("miss", key, duration)
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            stats = self.stats
+            return CacheInfo(stats.hits, stats.lookups - stats.hits, self.maxsize, len(self._data))
+
+    def snapshot(self) -> dict[str, Any]:
+        """The stats with the current size and the limits of the cache, as a dict."""
+        with self._lock:
+            stats = self.stats.copy()
+            size = len(self._data)
+        return {**stats.as_dict(), "currsize": size, "maxsize": self.maxsize, "ttl": self.ttl}
+
+    def get_or_compute(self, key, func: Callable, args: tuple = (), kwargs: dict | None = None):
+        waiting = None
+        flight = None
+        with self._lock:
+            value = self._lookup(key, self._timer())
+            if value is not _MISSING:
+                self.stats.hits += 1
+                if _hooks:
+                    self._events.append(("hit", key, None))
+            else:
+                flight = self._in_flight.get(key)
+                if flight is None:
+                    flight = self._in_flight[key] = _Flight()
+                elif flight.owner == threading.get_ident():
+                    # a recursive call for the same key can't wait for itself
+                    flight = None
+                else:
+                    self.stats.hits += 1
+                    self._event("hit", key)
+                    waiting = flight.future
+        if self._events:
+            self._emit_events()
+        if value is not _MISSING:
+            if type(value) is _CachedFailure:
+                raise value.error
+            return value
+        if waiting is not None:
+            return waiting.result()
+
+        started = time.perf_counter()
+        try:
+            entry = self._load(key) if self.store is not None else None
+            if entry is None:
+                value = func(*args, **(kwargs or {}))
+                ttl = None
+            else:
+                value, ttl = entry
+        except BaseException as error:
+            with self._lock:
+                self._record_outcome(key, False, True, time.perf_counter() - started)
+                if self.cache_failures and isinstance(error, Exception):
+                    self._store(key, _CachedFailure(error), self._timer())
+                if flight is not None:
+                    del self._in_flight[key]
+            if flight is not None:
+                flight.future.set_exception(error)
+            if self._events:
+                self._emit_events()
+            raise
+
+        with self._lock:
+            self._record_outcome(key, entry is not None, False, time.perf_counter() - started)
+            self._store(key, value, self._timer(), ttl)
+            if flight is not None:
+                del self._in_flight[key]
+        if flight is not None:
+            flight.future.set_result(value)
+        if self._events:
+            self._emit_events()
+        if self.store is not None and entry is None:
+            self._persist(key, value)
+        return value
+
+    async def _acompute(self, key, func: Callable, args: tuple, kwargs: dict):
+        started = time.perf_counter()
+        try:
+            entry = await asyncio.to_thread(self._load, key) if self.store is not None else None
+            if entry is None:
+                value = await func(*args, **kwargs)
+                ttl = None
+            else:
+                value, ttl = entry
+        except Exception as error:
+            with self._lock:
+                self._record_outcome(key, False, True, time.perf_counter() - started)
+                if self.cache_failures:
+                    self._store(key, _CachedFailure(error), self._timer())
+            raise
+        else:
+            with self._lock:
+                self._record_outcome(key, entry is not None, False, time.perf_counter() - started)
+                self._store(key, value, self._timer(), ttl)
+            if self.store is not None and entry is None:
+                await asyncio.to_thread(self._persist, key, value)
+            return value
+        finally:
+            with self._lock:
+                if self._in_flight_tasks.get(key) is asyncio.current_task():
+                    del self._in_flight_tasks[key]
+            if self._events:
+                self._emit_events()
+
+    async def aget_or_compute(self, key, func: Callable, args: tuple = (), kwargs: dict | None = None):
+        """
+        Like `get_or_compute` for a coroutine function: the awaited result is cached, and
+        concurrent awaiters of a key share one task, which is not cancelled with them.
+        """
+        loop = asyncio.get_running_loop()
+        task = None
+        with self._lock:
+            value = self._lookup(key, self._timer())
+            if value is not _MISSING:
+                self.stats.hits += 1
+                if _hooks:
+                    self._events.append(("hit", key, None))
+            else:
+                task = self._in_flight_tasks.get(key)
+                if task is None or task.get_loop() is not loop:
+                    task = loop.create_task(self._acompute(key, func, args, kwargs or {}))
+                    task.add_done_callback(_retrieve_exception)
+                    self._in_flight_tasks[key] = task
+                elif task is asyncio.current_task():
+                    # a recursive call for the same key can't wait for itself
+                    task = None
+                else:
+                    self.stats.hits += 1
+                    self._event("hit", key)
+        if self._events:
+            self._emit_events()
+        if value is not _MISSING:
+            if type(value) is _CachedFailure:
+                raise value.error
+            return value
+        if task is not None:
+            return await asyncio.shield(task)
+
+        started = time.perf_counter()
+        failed = True
+        try:
+            value = await func(*args, **(kwargs or {}))
+            failed = False
+            return value
+        finally:
+            with self._lock:
+                self._record_outcome(key, False, failed, time.perf_counter() - started)
+            if self._events:
+                self._emit_events()
+
+
+class _HashedKey(list):
+    # hashes the key once instead of on every dict operation, like functools' _HashedSeq
+    __slots__ = ("hash_value",)
+
+    def __init__(self, key: tuple):
+        self.hash_value = hash(key)
+        self[:] = key
+
+    def __hash__(self):
+        return self.hash_value
+
+
+def _make_key(args: tuple, kwargs: dict, typed: bool) -> Hashable:
+    key = args
+    if kwargs:
+        key += (_KWARGS_MARK,) + tuple(kwargs.items())
+    if typed:
+        key += tuple(type(value) for value in args)
+        if kwargs:
+            key += tuple(type(value) for value in kwargs.values())
+    elif len(key) == 1 and type(key[0]) in {int, str}:
+        return key[0]
+    try:
+        return _HashedKey(key)
+    except TypeError:
+        # dicts, lists and sets among the arguments
+        return _HashedKey(freeze(key))
+
+
+def _key_builder(func: Callable, typed: bool, key: Callable | None, ignore: Iterable[str | int] | None) -> Callable:
+    if key is not None:
+        def build_custom_key(args: tuple, kwargs: dict) -> Hashable:
+            value = key(*args, **kwargs)
+            try:
+                hash(value)
+            except TypeError:
+                value = freeze(value)
+            return value
+        return build_custom_key
+
+    if not ignore:
+        return lambda args, kwargs: _make_key(args, kwargs, typed)
+
+    names = {name for name in ignore if isinstance(name, str)}
+    positions = {position for position in ignore if isinstance(position, int)}
+    parameters = list(inspect.signature(func).parameters.values())
+    for position, parameter in enumerate(parameters):
+        if parameter.name in names and parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD):
+            positions.add(position)
+
+    def build_key(args: tuple, kwargs: dict) -> Hashable:
+        if positions:
+            args = tuple(value for position, value in enumerate(args) if position not in positions)
+        if names and not names.isdisjoint(kwargs):
+            kwargs = {name: value for name, value in kwargs.items() if name not in names}
+        return _make_key(args, kwargs, typed)
+    return build_key
+
+
+def ttl_cache(
+        maxsize: int = 128,
+        typed: bool = False,
+        ttl: int = 60 * 60,
+        jitter: float = 0.0,
+        cache_failures: bool = False,
+        key: Callable[..., Hashable] | None = None,
+        ignore: Iterable[str | int] | None = None,
+        store: SQLiteStore | None = None
+):
+    """
+    Like `functools.lru_cache`, but every result expires `ttl` seconds after it was computed.
+    Coroutine functions are supported: their awaited results are cached.
+    Dict, list and set arguments are supported as well, see `lodash.dict_sha.freeze`.
+    `cache_stats` of the wrapped function has hit, miss, eviction and expiration counters
+    and the latency of misses, see `CacheStats`.
+
+    Args:
+        maxsize: the maximum number of cached results, None for unbounded.
+        typed: cache arguments of different types separately.
+        ttl: the lifetime of a result in seconds.
+        jitter: a fraction of `ttl` by which lifetimes are randomly shortened.
+        cache_failures: cache exceptions raised by the function like results.
+        key: builds the cache key from the call arguments instead of the default.
+        ignore: names or positions of arguments which are left out of the key.
+        store: a persistent second tier shared with other processes, see `SQLiteStore`.
+    """
     if ttl <= 0:
         ttl = 65536
 
-    hash_gen = _ttl_hash_gen(ttl)
-
     def wrapper(func: Callable) -> Callable:
-        @lru_cache(maxsize, typed)
-        def ttl_func(ttl_hash,  *args, **kwargs):
-            return func(*args, **kwargs)
+        cache = TTLCache(
+            maxsize, ttl, jitter,
+            cache_failures=cache_failures,
+            store=store,
+            namespace=f"{func.__module__}.{func.__qualname__}"
+        )
+        build_key = _key_builder(func, typed, key, ignore)
+
+        if inspect.iscoroutinefunction(func):
+            async def wrapped(*args, **kwargs) -> Any:
+                return await cache.aget_or_compute(build_key(args, kwargs), func, args, kwargs)
+        else:
+            def wrapped(*args, **kwargs) -> Any:
+                return cache.get_or_compute(build_key(args, kwargs), func, args, kwargs)
 
-        def wrapped(*args, **kwargs) -> Any:
-            th = next(hash_gen)
-            return ttl_func(th, *args, **kwargs)
+        wrapped.cache = cache
+        wrapped.cache_info = cache.info
+        wrapped.cache_stats = cache.stats
+        wrapped.cache_clear = cache.clear
         return update_wrapper(wrapped, func)
     return wrapper
-
-
-def _ttl_hash_gen(seconds: int):
-    start_time = time.time()
-
-    while True:
-        yield floor((time.time() - start_time) / seconds)
@@ -0,0 +1,299 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+import time
+from datetime import date, time as time_of_day, timedelta
+from decimal import Decimal
+from enum import Enum
+from fractions import Fraction
+from typing import Any, Literal
+from uuid import UUID
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at);
+CREATE INDEX IF NOT EXISTS entries_lru ON entries (accessed_at);
+CREATE INDEX IF NOT EXISTS entries_lfu ON entries (hits, accessed_at);
+CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), entries INTEGER NOT NULL, bytes INTEGER NOT NULL);
+INSERT OR IGNORE INTO totals VALUES (0, 0, 0);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    UPDATE totals SET entries = entries + 1, bytes = bytes + NEW.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    UPDATE totals SET entries = entries - 1, bytes = bytes - OLD.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN
+    UPDATE totals SET bytes = bytes - OLD.size + NEW.size WHERE id = 0;
+END;
+"""
+
+# types whose repr is determined by their value, so it identifies them in every process
+_VALUE_REPR_TYPES = (date, time_of_day, timedelta, Decimal, UUID, Fraction, complex)
+
+
+class UnstableKeyError(TypeError):
+    """Raised for a cache key containing an object which has no canonical encoding."""
+
+
+_EVICTION_ORDER = {
+    "lru": "accessed_at",
+    "lfu": "hits, accessed_at",
+}
+
+
+def _encode_key(obj: Any, parts: list[bytes]) -> None:
+    # a canonical, type-tagged encoding which is the same in every process
+    cls = type(obj)
+    if obj is None or cls is bool:
+        parts.append(b"N" if obj is None else b"T" if obj else b"F")
+    elif cls is int:
+        parts.append(b"i%d;" % obj)
+    elif cls is float:
+        parts.append(b"f" + struct.pack(">d", obj))
+    elif cls is str:
+        data = obj.encode("utf-8", "surrogatepass")
+        parts.append(b"s%d:" % len(data) + data)
+    elif cls is bytes:
+        parts.append(b"b%d:" % len(obj) + obj)
+    elif isinstance(obj, (list, tuple)):
+        parts.append(b"l(" if isinstance(obj, list) else b"t(")
+        for value in obj:
+            _encode_key(value, parts)
+        parts.append(b")")
+    elif isinstance(obj, (set, frozenset)):
+        parts.append(b"S(" + b"".join(sorted(_key_bytes(value) for value in obj)) + b")")
+    elif isinstance(obj, dict):
+        items = sorted(_key_bytes(key) + _key_bytes(value) for key, value in obj.items())
+        parts.append(b"d(" + b"".join(items) + b")")
+    elif isinstance(obj, type):
+        parts.append(b"c" + _key_bytes(f"{obj.__module__}.{obj.__qualname__}"))
+    elif isinstance(obj, Enum):
+        parts.append(b"e" + _key_bytes(f"{cls.__module__}.{cls.__qualname__}.{obj.name}"))
+    elif isinstance(obj, (int, float, str, bytes)):
+        # subclasses of the basic types are keyed by their value
+        _encode_key(next(base for base in (int, float, str, bytes) if isinstance(obj, base))(obj), parts)
+    elif isinstance(obj, _VALUE_REPR_TYPES) or getattr(cls, "_stable_repr", False):
+        parts.append(b"o" + _key_bytes(f"{cls.__module__}.{cls.__qualname__}") + _key_bytes(repr(obj)))
+    else:
+        # other reprs may be equal for different objects (or differ for equal ones), so such keys aren't persisted
+        raise UnstableKeyError(f"{cls.__module__}.{cls.__qualname__} can't be part of a persistent cache key")
+
+
+def _key_bytes(obj: Any) -> bytes:
+    parts: list[bytes] = []
+    _encode_key(obj, parts)
+    return b"".join(parts)
+
+
+def stable_key_digest(key: Any) -> str:
+    """
+    A digest of a cache key which is the same in every process and across restarts.
+    Raises `UnstableKeyError` if the key contains objects other than basic values, containers,
+    types, enums and value types like dates, decimals or UUIDs.
+    """
+    return hashlib.sha256(_key_bytes(key)).hexdigest()
+
+
+class SQLiteStore:
+    """
+    A persistent cache store in a local SQLite database, shared by processes on one host.
+
+    Entries expire after their TTL; when `max_entries` or `max_bytes` is exceeded, expired
+    entries are removed first and then the least recently (`lru`) or least frequently
+    (`lfu`) used ones. Values are serialized with `serializer` (anything with `dumps` and
+    `loads`, `pickle` by default); values it can't serialize are simply not stored, and neither
+    are values under keys without a canonical encoding (see `stable_key_digest`). Database
+    errors, such as a database locked for longer than `timeout`, are not raised: lookups miss,
+    writes and deletions are skipped, and `len` and `size` report 0.
+
+    Example:
+        store = SQLiteStore("/tmp/lodash-cache.sqlite", max_bytes=256 * 1024 * 1024)
+
+        @ttl_cache(ttl=24 * 60 * 60, store=store)
+        def extract_document(path: str) -> str:
+            ...
+    """
+
+    def __init__(
+            self,
+            path: str,
+            max_entries: int | None = None,
+            max_bytes: int | None = None,
+            ttl: float | None = None,
+            policy: Literal["lru", "lfu"] = "lru",
+            serializer: Any = pickle,
+            timeout: float = 5.0
+    ):
+        if policy not in _EVICTION_ORDER:
+            raise ValueError(f"Invalid eviction policy {policy}")
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.policy = policy
+        self.serializer = serializer
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # connections can't be shared between threads or across a fork
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get_entry(self, key: Any, namespace: str = "") -> tuple[Any, float] | None:
+        """
+        The value and the expiry timestamp (time.time) of a live entry, None otherwise.
+        Database errors (e.g. a locked database) count as a miss.
+        """
+        try:
+            digest = stable_key_digest(key)
+        except UnstableKeyError:
+            return None
+        now = time.time()
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                "SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, digest, now)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE entries SET accessed_at = ?, hits = hits + 1 WHERE namespace = ? AND key = ?",
+                (now, namespace, digest)
+            )
+        except sqlite3.Error:
+            return None
+        try:
+            value = self.serializer.loads(row[0])
+        except Exception:
+            self.delete(key, namespace)
+            return None
+        return value, row[1]
+
+    def get(self, key: Any, default: Any = None, namespace: str = "") -> Any:
+        entry = self.get_entry(key, namespace)
+        return default if entry is None else entry[0]
+
+    def set(self, key: Any, value: Any, ttl: float | None = None, namespace: str = "") -> bool:
+        """Stores a value; returns False if the key or the value can't be serialized or the database fails."""
+        try:
+            digest = stable_key_digest(key)
+        except UnstableKeyError:
+            return False
+        try:
+            data = self.serializer.dumps(value)
+        except Exception:
+            return False
+        if self.ttl is not None:
+            ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else float("inf")
+        try:
+            connection = self._connection()
+            connection.execute(
+                "INSERT INTO entries (namespace, key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET "
+                "value = excluded.value, size = excluded.size, expires_at = excluded.expires_at, accessed_at = excluded.accessed_at",
+                (namespace, digest, data, len(data), expires_at, now)
+            )
+            self._evict(connection, now)
+        except sqlite3.Error:
+            return False
+        return True
+
+    def delete(self, key: Any, namespace: str = "") -> None:
+        try:
+            digest = stable_key_digest(key)
+        except UnstableKeyError:
+            return
+        try:
+            self._connection().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, digest))
+        except sqlite3.Error:
+            pass
+
+    def clear(self, namespace: str | None = None) -> None:
+        try:
+            if namespace is None:
+                self._connection().execute("DELETE FROM entries")
+            else:
+                self._connection().execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+        except sqlite3.Error:
+            pass
+
+    def purge_expired(self) -> None:
+        try:
+            self._connection().execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error:
+            pass
+
+    def __len__(self) -> int:
+        try:
+            return self._connection().execute("SELECT entries FROM totals WHERE id = 0").fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def size(self) -> int:
+        """The total size of the stored values in bytes."""
+        try:
+            return self._connection().execute("SELECT bytes FROM totals WHERE id = 0").fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def _over_limits(self, connection: sqlite3.Connection) -> tuple[int, int]:
+        entries, size = connection.execute("SELECT entries, bytes FROM totals WHERE id = 0").fetchone()
+        excess_entries = entries - self.max_entries if self.max_entries is not None else 0
+        excess_bytes = size - self.max_bytes if self.max_bytes is not None else 0
+        return excess_entries, excess_bytes
+
+    def _evict(self, connection: sqlite3.Connection, now: float) -> None:
+        if self.max_entries is None and self.max_bytes is None:
+            return
+        excess_entries, excess_bytes = self._over_limits(connection)
+        if excess_entries <= 0 and excess_bytes <= 0:
+            return
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            excess_entries, excess_bytes = self._over_limits(connection)
+            if excess_entries > 0 or excess_bytes > 0:
+                # evict by the policy until both limits are met, in one statement
+                connection.execute(
+                    f"DELETE FROM entries WHERE rowid IN ("
+                    f"SELECT rowid FROM ("
+                    f"SELECT rowid, size, ROW_NUMBER() OVER w AS position, SUM(size) OVER w AS freed "
+                    f"FROM entries WINDOW w AS (ORDER BY {_EVICTION_ORDER[self.policy]} ROWS UNBOUNDED PRECEDING)"
+                    f") WHERE position - 1 < ? OR freed - size < ?)",
+                    (max(excess_entries, 0), max(excess_bytes, 0))
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def close(self) -> None:
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
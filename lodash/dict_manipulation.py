@@ -3,9 +3,11 @@ import re
 
 import json5.dumper
 from copy import deepcopy
-from lodash.string_manipulation import truncate_string as truncate, match_keypath
+from functools import lru_cache
+from lodash.string_manipulation import truncate_string as truncate, match_keypath, split_keypath, KeyPathMatcher, compile_keypath_matcher
 from lodash._json_comment_dumper import DumpListWithComments
-from typing import Any
+from lodash.tree_walker import Prune, path_to_keypath, root_path, transform
+from typing import Any, NamedTuple
 
 def __int(v):
     try:
@@ -16,15 +18,21 @@ def __int(v):
 def __isint(v):
     return isinstance(v, int) or str(__int(v)) == str(v)
 
-def _to_path(path):
-    if isinstance(path, int):
-        return [path]
-    if isinstance(path, list):
-        return path
+_PATH_PATTERN = re.compile(r'[^.[\]]+|\[(?:(-?\d+(?:\.\d+)?)|(["\'])((?:(?!\2)[^\\]|\\.)*?)\2)\]|(?=(?:\.|\[\])(?:\.|\[\]|$))')
+COMPILED_PATHS_MAXSIZE = 4096
+CUT_OFF_PLACEHOLDER = "[...cut off the data due to context size...]"
 
-    pattern = re.compile(r'[^.[\]]+|\[(?:(-?\d+(?:\.\d+)?)|(["\'])((?:(?!\2)[^\\]|\\.)*?)\2)\]|(?=(?:\.|\[\])(?:\.|\[\]|$))')
+
+class CompiledPath(NamedTuple):
+    """An immutable, pre-parsed keypath accepted by `dig`, `digwrite` and `dig_json_schema`."""
+    path: Any
+    segments: tuple
+    json_schema_segments: tuple
+
+
+def _parse_path(path: str) -> list:
     parts = []
-    def add_match(match):
+    for match in _PATH_PATTERN.finditer(path):
         number, quote, subString = match.groups()
         if quote:
             parts.append(subString.replace(r'\\', '\\'))
@@ -36,12 +44,10 @@ def _to_path(path):
                 parts.append(number)
         else:
             parts.append(match.group(0))
-
-    re.sub(pattern, add_match, path)
     return parts
 
-def _to_path_json_schema(path):
-    paths = _to_path(path)
+
+def _json_schema_segments(paths) -> tuple:
     result_paths = []
     for item in paths:
         if item == '':
@@ -53,7 +59,55 @@ def _to_path_json_schema(path):
         if isinstance(item, int):
             result_paths.append('items')
 
-    return result_paths
+    return tuple(result_paths)
+
+
+def _build_compiled_path(path, segments) -> CompiledPath:
+    segments = tuple(segments)
+    return CompiledPath(path, segments, _json_schema_segments(segments))
+
+
+@lru_cache(maxsize=COMPILED_PATHS_MAXSIZE)
+def _compile_string_path(path: str) -> CompiledPath:
+    return _build_compiled_path(path, _parse_path(path))
+
+
+def compile_path(path: str | int | list | tuple | CompiledPath) -> CompiledPath:
+    """
+    Parses a keypath once and returns an immutable `CompiledPath` that can be reused for lookups.
+
+    String paths go through a bounded LRU cache, so the same keypath is parsed only once per process.
+
+    Args:
+        path: A keypath like "a[0].b[3].c", a single index, a list of segments or an already compiled path.
+
+    Returns:
+        CompiledPath: The parsed segments together with their JSON-schema variant.
+    """
+    if isinstance(path, CompiledPath):
+        return path
+    if isinstance(path, str):
+        return _compile_string_path(path)
+    if isinstance(path, int):
+        return _build_compiled_path(path, [path])
+    if isinstance(path, (list, tuple)):
+        return _build_compiled_path(tuple(path), path)
+    raise TypeError(f"Cannot compile path from {type(path)}")
+
+
+compile_path.cache_info = _compile_string_path.cache_info
+compile_path.cache_clear = _compile_string_path.cache_clear
+
+
+def _to_path(path):
+    if isinstance(path, int):
+        return [path]
+    if isinstance(path, list):
+        return path
+    return list(compile_path(path).segments)
+
+def _to_path_json_schema(path):
+    return list(compile_path(path).json_schema_segments)
 
 def fetch(dictionary: dict, *keys, **kwargs):
     if 'default' not in kwargs and len(keys) > 0:
@@ -69,138 +123,336 @@ def fetch(dictionary: dict, *keys, **kwargs):
     return default
 
 
+def _dig_get(d, k):
+    if isinstance(d, (list, tuple)):
+        if not isinstance(k, int):
+            return None
+        if k >= len(d):
+            return None
+        try:
+            return d[k]
+        except IndexError:
+            return None
+    elif isinstance(d, dict):
+        return d.get(k)
+    return None
+
+
+def _dig_segments(keys) -> tuple:
+    """Flattens `dig` keys into the segments it walks; every key but the last is used as is, the last one is parsed."""
+    resolved = []
+    while keys:
+        if len(keys) > 1:
+            resolved.extend(keys[:-1])
+            keys = keys[-1:]
+
+        key = keys[0]
+        paths = compile_path(key).segments if isinstance(key, str) else _to_path(key)
+        if len(paths) == 1:
+            resolved.append(paths[0])
+            break
+        keys = paths
+    return tuple(resolved)
+
+
+@lru_cache(maxsize=COMPILED_PATHS_MAXSIZE)
+def _string_dig_segments(path: str) -> tuple:
+    return _dig_segments((path,))
+
+
 def dig(dictionary, *keys):
-    def _get(d, k):
-        if isinstance(d, (list, tuple)):
-            if not isinstance(k, int):
-                return None
-            if k >= len(d):
-                return None
-            try:
-                return d[k]
-            except IndexError:
-                return None
-        elif isinstance(d, dict):
-            return d.get(k)
-        else:
-            ValueError(f"Cannot get {k} from {d}")
+    if len(keys) == 1 and isinstance(keys[0], str):
+        segments = _string_dig_segments(keys[0])
+    else:
+        segments = _dig_segments(keys)
 
-    if not keys:
-        return dictionary
+    value = dictionary
+    for key in segments:
+        value = _dig_get(value, key)
+        if value is None:
+            return None
+    return value
 
-    if len(keys) == 1:
-        paths = _to_path(keys[0])
 
-        if len(paths) == 1:
-            return _get(dictionary, paths[0])
+class DigExtractor:
+    """
+    Reads many keypaths from a document at once, walking every shared path prefix only once.
+
+    Build it once for a set of paths and reuse it on every document: `DigExtractor(["a.b", "a.c[0]"]).extract(data)`.
+    A list of paths gives a tuple of values in the same order, a `{name: path}` mapping gives a dict keyed by name.
+    Missing values are None, like in `dig`.
+    """
+
+    def __init__(self, paths):
+        if isinstance(paths, dict):
+            self.names = tuple(paths.keys())
+            paths = paths.values()
         else:
-            return dig(dictionary, *paths)
+            self.names = None
+
+        trie = ({}, [])
+        size = 0
+        for index, path in enumerate(paths):
+            node = trie
+            for segment in _dig_segments((path,)):
+                node = node[0].setdefault(segment, ({}, []))
+            node[1].append(index)
+            size += 1
+
+        self._size = size
+        self._root = self._compress(trie)
+
+    @classmethod
+    def _compress(cls, node):
+        """Turns the trie into `(ends, [(segments, child), ...])`, merging chains of single-child nodes into one edge."""
+        children, ends = node
+        edges = []
+        for segment, child in children.items():
+            segments = [segment]
+            while len(child[0]) == 1 and not child[1]:
+                (segment, child), = child[0].items()
+                segments.append(segment)
+            edges.append((tuple(segments), cls._compress(child)))
+        return tuple(ends), edges
+
+    def extract(self, data) -> tuple | dict:
+        results = [None] * self._size
+        stack = [(self._root, data)]
+        while stack:
+            (ends, edges), value = stack.pop()
+            for index in ends:
+                results[index] = value
+            for segments, child in edges:
+                child_value = value
+                for segment in segments:
+                    if type(child_value) is dict:
+                        child_value = child_value.get(segment)
+                    else:
+                        child_value = _dig_get(child_value, segment)
+                    if child_value is None:
+                        break
+                else:
+                    stack.append((child, child_value))
+
+        if self.names is None:
+            return tuple(results)
+        return dict(zip(self.names, results))
 
-    return dig(_get(dictionary, keys[0]), *keys[1:])
+    __call__ = extract
+
+
+@lru_cache(maxsize=256)
+def _cached_extractor(paths: tuple, named: bool) -> DigExtractor:
+    return DigExtractor(dict(paths) if named else paths)
+
+
+def compile_extractor(paths) -> DigExtractor:
+    """Returns a reusable `DigExtractor` for `paths`; extractors for string paths are cached."""
+    named = isinstance(paths, dict)
+    if not named:
+        # read once, as `paths` may be an iterator
+        paths = list(paths)
+    key = tuple(paths.items()) if named else tuple(paths)
+    try:
+        return _cached_extractor(key, named)
+    except TypeError:
+        return DigExtractor(paths)
+
+
+def dig_many(dictionary, paths) -> tuple | dict:
+    """
+    Reads several keypaths from the same document, walking shared path prefixes only once.
+
+    Args:
+        dictionary: The dictionary or list to read from.
+        paths: A list of keypaths, or a `{name: keypath}` mapping.
+
+    Returns:
+        A tuple of values in the order of `paths`, or a dict keyed by name when a mapping was given.
+        Missing values are None, like in `dig`.
+    """
+    return compile_extractor(paths).extract(dictionary)
 
 
 def dig_json_schema(dictionary, key):
-    paths = _to_path_json_schema(key)
+    paths = compile_path(key).json_schema_segments
     return dig(dictionary, *paths)
 
 
-def digwrite(dictionary, key, value):
-    dictionary = deepcopy(dictionary)
-    paths = _to_path(key)
+def _own(d, owned):
+    """Returns a container that may be modified in place, shallow-copying `d` unless it was created by this write."""
+    if owned is None or not isinstance(d, (dict, list)) or id(d) in owned:
+        return d
+    d = d.copy()
+    owned.add(id(d))
+    return d
 
-    def _set(d, path, val):
-        if len(path) == 1:
-            key = path[0]
 
+def _new_container(container, owned):
+    if owned is not None:
+        owned.add(id(container))
+    return container
+
+
+def _write_level(d, ops, owned):
+    """
+    Applies write operations to the container `d` in their original order.
+
+    Every operation is a `(path, depth, value)` tuple whose key at `depth` addresses `d`. Operations that
+    go deeper are grouped per child and applied to that child in one pass, which gives the same result as
+    applying them one by one, because writes into different children never affect each other.
+    """
+    d = _own(d, owned)
+    pending = {}
+
+    def _flush(slot):
+        d[slot] = _write_level(d[slot], pending.pop(slot), owned)
+
+    for path, depth, val in ops:
+        key = path[depth]
+
+        if depth == len(path) - 1:
             if key == '':
                 if isinstance(d, list):
                     d.append(val)
                 elif isinstance(d, dict):
-                    raise ValueError(f"Cannot set value at path {path} on {type(d)}")
+                    raise ValueError(f"Cannot set value at path {path[depth:]} on {type(d)}")
             elif isinstance(key, str) and len(key) > 0:
                 if isinstance(d, list):
-                    el = {}
+                    el = _new_container({}, owned)
                     d.append(el)
                     el[key] = val
                 elif isinstance(d, dict):
+                    if key in pending:
+                        _flush(key)
                     d[key] = val
             elif isinstance(key, int):
                 if isinstance(d, list):
                     if key >= len(d) or len(d) == 0:
                         d.append(val)
                     else:
+                        slot = key if key >= 0 else len(d) + key
+                        if slot in pending:
+                            _flush(slot)
                         d[key] = val
                 else:
-                    raise ValueError(f"Cannot set value at path {path} on {type(d)}")
+                    raise ValueError(f"Cannot set value at path {path[depth:]} on {type(d)}")
             else:
-                raise ValueError(f"Cannot set value at path {path} on {type(d)}")
-        else:
-            key = path[0]
-            key1 = path[1]
-            rest = path[1:]
+                raise ValueError(f"Cannot set value at path {path[depth:]} on {type(d)}")
+            continue
 
-            if key == '':
-                if key1 == '' or __isint(key1):
-                    el = []
-                    d.append(el)
-                    _set(el, rest, val)
-                elif isinstance(key1, str) and len(key1) > 0:
-                    el = {}
-                    d.append(el)
-                    _set(el, rest, val)
-                else:
-                    raise ValueError(f"Cannot navigate path {path} on {type(d)}")
-            elif isinstance(key, str) and len(key) > 0:
-                if isinstance(d, list):
-                    el = {}
-                    d.append(el)
-                    el[key] = {}
-                    _set(el[key], rest, val)
-                elif isinstance(d, dict):
-                    if key not in d:
-                        if key1 == '' or __isint(key1):
-                            d[key] = []
-                        elif isinstance(key1, str) and len(key1) > 0:
-                            d[key] = {}
-                        else:
-                            raise ValueError(f"Cannot navigate path {path} on {type(d)}")
-                    _set(d[key], rest, val)
-                else:
-                    raise ValueError(f"Cannot navigate path {path} on {type(d)}")
-            elif isinstance(key, int):
-                if isinstance(d, list):
-                    if key >= len(d) or len(d) == 0:
-                        d.append({})
-                    _set(d[key], rest, val)
-                elif isinstance(d, dict):
-                    _set(d[key], rest, val)
-                else:
-                    raise ValueError(f"Cannot navigate path {path} on {type(d)}")
+        key1 = path[depth + 1]
+        next_op = (path, depth + 1, val)
+
+        if key == '':
+            if key1 == '' or __isint(key1):
+                el = []
+            elif isinstance(key1, str) and len(key1) > 0:
+                el = {}
+            else:
+                raise ValueError(f"Cannot navigate path {path[depth:]} on {type(d)}")
+            d.append(_new_container(el, owned))
+            slot = len(d) - 1
+        elif isinstance(key, str) and len(key) > 0:
+            if isinstance(d, list):
+                el = _new_container({}, owned)
+                d.append(el)
+                el[key] = _new_container({}, owned)
+                slot = len(d) - 1
+                next_op = (path, depth, val)
+            elif isinstance(d, dict):
+                if key not in d:
+                    if key1 == '' or __isint(key1):
+                        d[key] = _new_container([], owned)
+                    elif isinstance(key1, str) and len(key1) > 0:
+                        d[key] = _new_container({}, owned)
+                    else:
+                        raise ValueError(f"Cannot navigate path {path[depth:]} on {type(d)}")
+                slot = key
             else:
-                raise ValueError(f"Cannot navigate path {path} on {type(d)}")
-    _set(dictionary, paths, value)
-    return dictionary
+                raise ValueError(f"Cannot navigate path {path[depth:]} on {type(d)}")
+        elif isinstance(key, int):
+            if isinstance(d, list):
+                if key >= len(d) or len(d) == 0:
+                    d.append(_new_container({}, owned))
+                d[key]  # raises for an index past the end, like the sequential write does
+                slot = key if key >= 0 else len(d) + key
+            elif isinstance(d, dict):
+                d[key]
+                slot = key
+            else:
+                raise ValueError(f"Cannot navigate path {path[depth:]} on {type(d)}")
+        else:
+            raise ValueError(f"Cannot navigate path {path[depth:]} on {type(d)}")
+
+        pending.setdefault(slot, []).append(next_op)
+
+    for slot in list(pending):
+        _flush(slot)
+    return d
+
+
+def digwrite(dictionary, key, value, *, copy_on_write: bool = False):
+    """
+    Returns a copy of `dictionary` with `value` written at the `key` path, creating missing containers on the way.
+
+    Args:
+        dictionary: The dictionary or list to write into. It is never modified.
+        key: A keypath like "a[0].b[].c"; `[]` appends to a list.
+        value: The value to write.
+        copy_on_write: Copy only the containers along the written path and share every other subtree
+            with the input instead of deep-copying the whole structure.
+
+    Returns:
+        A new dictionary or list with the value written.
+    """
+    if copy_on_write:
+        return _write_level(dictionary, [(_to_path(key), 0, value)], set())
+    return _write_level(deepcopy(dictionary), [(_to_path(key), 0, value)], None)
+
+
+def digwrite_many(dictionary, writes, *, copy_on_write: bool = True):
+    """
+    Writes many values in a single traversal; the result is the same as chaining `digwrite` calls in order.
+
+    Writes are grouped by their shared path prefixes, so every touched container is copied once
+    no matter how many values land in it.
+
+    Args:
+        dictionary: The dictionary or list to write into. It is never modified.
+        writes: A `{path: value}` mapping or an iterable of `(path, value)` pairs, applied in order.
+        copy_on_write: Share untouched subtrees with the input; pass False to deep-copy it first.
+
+    Returns:
+        A new dictionary or list with all the values written.
+    """
+    if isinstance(writes, dict):
+        writes = writes.items()
+    if copy_on_write:
+        ops = [(_to_path(key), 0, value) for key, value in writes]
+    else:
+        # chained deep-copying writes copy every written value before the next write, so later
+        # writes into it never reach the caller's object or other places the same value was written to
+        ops = [(_to_path(key), 0, deepcopy(value)) for key, value in writes]
+        dictionary = deepcopy(dictionary)
+    if not ops:
+        return dictionary
+    return _write_level(dictionary, ops, set() if copy_on_write else None)
 
 def to_path(path: str) -> list[str | int]:
     """Converts a path-like string into a list of individual elements. Used by the `dig` and `digwrite` functions."""
     return _to_path(path)
 
 def cut_up_values(data, max_length: int = 120, symbols='...'):
-    def _cut_up_object(obj):
-        if isinstance(obj, str):
+    # strings up to twice `max_length` are kept as they are when cut in brackets
+    longest_kept = 2 * max_length
+
+    def _cut_up_object(path, obj):
+        if isinstance(obj, str) and len(obj) > longest_kept:
             return truncate(obj, max_length=max_length, symbols=symbols, position='brackets')
-        elif isinstance(obj, list):
-            return [_cut_up_object(v) for v in obj]
-        elif isinstance(obj, dict):
-            return {k: _cut_up_object(v) for k, v in obj.items()}
-        elif isinstance(obj, tuple):
-            return tuple(_cut_up_object(v) for v in obj)
-        elif isinstance(obj, set):
-            return {_cut_up_object(v) for v in obj}
-        else:
-            return obj
+        return obj
 
-    return _cut_up_object(data)
+    return transform(data, _cut_up_object, types=(dict, list, tuple, set))
 
 
 def dump_json_with_index_comments(obj) -> str:
@@ -208,7 +460,7 @@ def dump_json_with_index_comments(obj) -> str:
     result = json5.dumps(obj, dumper=dumper)
     return result
 
-def truncate_fields_from_focused_out_fields(*, initial_path: str, data, focused_out_truncate_fields: list[str]) -> dict | list:
+def _truncate_fields_by_keypath(*, initial_path: str, data, focused_out_truncate_fields: list[str]) -> dict | list:
     if not focused_out_truncate_fields:
         return data
 
@@ -224,9 +476,9 @@ def truncate_fields_from_focused_out_fields(*, initial_path: str, data, focused_
             )
 
             if should_truncate:
-                result[key] = "[...cut off the data due to context size...]"
+                result[key] = CUT_OFF_PLACEHOLDER
             else:
-                result[key] = truncate_fields_from_focused_out_fields(
+                result[key] = _truncate_fields_by_keypath(
                     initial_path=full_path,
                     data=value,
                     focused_out_truncate_fields=focused_out_truncate_fields
@@ -234,7 +486,7 @@ def truncate_fields_from_focused_out_fields(*, initial_path: str, data, focused_
 
     elif isinstance(data, list):
         result = [
-            truncate_fields_from_focused_out_fields(
+            _truncate_fields_by_keypath(
                 initial_path=f"{initial_path}[{i}]",
                 data=item,
                 focused_out_truncate_fields=focused_out_truncate_fields
@@ -247,6 +499,90 @@ def truncate_fields_from_focused_out_fields(*, initial_path: str, data, focused_
     return result
 
 
+# marks keys that can't be split into keypath parts, whose values are truncated by their full path
+_UNSPLIT_KEY = object()
+
+
+def _truncate_fields_by_matcher(matcher: KeyPathMatcher, data, state, initial_path: str, templates: list[str]) -> dict | list:
+    advance_key, matched = matcher.advance_key, matcher.MATCH
+    # the states after every key, per state, for this call
+    transitions: dict[Any, dict[str, Any]] = {}
+    # per container: its path (so that its id isn't reused while walking) and, for dicts, the
+    # states after its keys or, for lists, the state of its items
+    states = {}
+
+    def truncate_container(path, value):
+        parent, key, is_index = path
+        if is_index is None:
+            node_state = state
+        elif is_index:
+            node_state = states[id(parent)][1]
+        else:
+            node_state = states[id(parent)][1][key]
+            if node_state is _UNSPLIT_KEY:
+                # already truncated by keypath with its parent
+                return Prune(value)
+
+        if isinstance(value, list):
+            node_state = matcher.advance_index(node_state)
+            if not node_state:
+                return Prune(transform(value))
+            states[id(path)] = (path, node_state)
+            return value
+
+        if not node_state:
+            return Prune(transform(value))
+        key_states = transitions.get(node_state)
+        if key_states is None:
+            key_states = transitions[node_state] = {}
+        result = {}
+        for key, item in value.items():
+            key_state = key_states.get(key)
+            if key_state is None:
+                if isinstance(key, str) and '[' not in key:
+                    key_state = key_states[key] = advance_key(node_state, key)
+                else:
+                    # such keys can change how the rest of the path is split, so match the string
+                    key_state = key_states[key] = _UNSPLIT_KEY
+            if key_state is _UNSPLIT_KEY:
+                full_path = path_to_keypath((path, key, False))
+                if any(match_keypath(template, full_path) for template in templates):
+                    item = CUT_OFF_PLACEHOLDER
+                else:
+                    item = _truncate_fields_by_keypath(
+                        initial_path=full_path,
+                        data=item,
+                        focused_out_truncate_fields=templates
+                    )
+            elif key_state == matched:
+                item = CUT_OFF_PLACEHOLDER
+            result[key] = item
+        states[id(path)] = (path, key_states)
+        return result
+
+    return transform(data, truncate_container, leaves=False, path=root_path(initial_path))
+
+
+def truncate_fields_from_focused_out_fields(*, initial_path: str, data, focused_out_truncate_fields: list[str]) -> dict | list:
+    if not focused_out_truncate_fields:
+        return data
+
+    if not isinstance(data, (dict, list)):
+        return data
+
+    if not isinstance(initial_path, str) or split_keypath(initial_path + "[0]") != split_keypath(initial_path) + ["[0]"]:
+        # an unbalanced initial path would be split differently once more parts are appended
+        return _truncate_fields_by_keypath(
+            initial_path=initial_path,
+            data=data,
+            focused_out_truncate_fields=focused_out_truncate_fields
+        )
+
+    matcher = compile_keypath_matcher(focused_out_truncate_fields)
+    state = matcher.advance(matcher.start, split_keypath(initial_path))
+    return _truncate_fields_by_matcher(matcher, data, state, initial_path, focused_out_truncate_fields)
+
+
 def format_dict_to_markdown(data: dict[str, Any], level: int = 0) -> str:
     """
     Format a dictionary into a readable markdown structure.
@@ -302,6 +638,10 @@ if __name__ == '__main__':
         assert v == result, f"Expected: {result} for {args}, got: {repr(v)}"
 
     assert to_path("a[0].b[3].c") == ['a', 0, 'b', 3, 'c']
+    assert compile_path("a[0].b[3].c") is compile_path("a[0].b[3].c")
+    assert compile_path("a[0].b[3].c").segments == ('a', 0, 'b', 3, 'c')
+    assert compile_path("a[0].b[]").json_schema_segments == ('properties', 'a', 'items', 'properties', 'b', 'items')
+    assertion(dig, compile_path('e[0].f'), result=3)
     assertion(dig, 'a.b.c', result=1)
     assertion(dig, 'a.d', result=2)
     assertion(dig, 'e[0]', result={ 'f': 3, 'g': []})
@@ -314,6 +654,11 @@ if __name__ == '__main__':
     assertion(dig, 'a.b.c.d', result=None)
     assertion(dig, ['a', 'b', 'c'], result=1)
     assertion(dig, 'e[0].g[-1]', result=None)
+    assertion(dig_many, ['a.b.c', 'e[0].f', 'e[12].f', 'a.d'], result=(1, 3, None, 2))
+    assertion(dig_many, {'c': 'a.b.c', 'missing': 'a.b.c.d'}, result={'c': 1, 'missing': None})
+    assert compile_extractor(['a.b.c', 'e[1]']).extract(d) == (1, 4)
+    assert compile_extractor(path for path in ['a.b.c', 'e[1]']).extract(d) == (1, 4)
+    assert dig_many(d, iter([['a', 'b', 'c'], ['a', 'd']])) == (1, 2)
 
     assertion(digwrite, 'a.b.c', 4, result={
         'a': {
@@ -439,6 +784,20 @@ if __name__ == '__main__':
         ]
     })
 
+    shared = digwrite(d, 'e[0].g[]', 'shared_text', copy_on_write=True)
+    assert shared['e'][0]['g'] == ['shared_text'] and d['e'][0]['g'] == []
+    assert shared['a'] is d['a'] and shared['e'] is not d['e']
+    assert digwrite(d, 'e[][][].r', 'unexpected_raccoon', copy_on_write=True) == digwrite(d, 'e[][][].r', 'unexpected_raccoon')
+
+    writes = [('a.b.c', 5), ('e[].k[]', 'x'), ('e[0].g[]', 'y'), ('e[].k[]', 'z'), ('e[2].k[]', 'w'), ('a.n', [])]
+    sequential = d
+    for path, value in writes:
+        sequential = digwrite(sequential, path, value)
+    assertion(digwrite_many, writes, result=sequential)
+    assert digwrite_many(d, writes, copy_on_write=False) == sequential
+    v = {}
+    assert digwrite_many({}, [('a', v), ('c', v), ('a.b', 1)], copy_on_write=False) == {'a': {'b': 1}, 'c': {}} and v == {}
+
     # Tests for fetch function
     kwargs = {
         'responsibilities': 'main',
@@ -498,5 +857,9 @@ if __name__ == '__main__':
 
     assert truncate_fields_from_focused_out_fields(initial_path="", data=data, focused_out_truncate_fields=["a.b[i].c[j].y"]) == {
         "a": {"b": [{"c": [{"y": "[...cut off the data due to context size...]"}]}, {}, {}]}}
+    assert truncate_fields_from_focused_out_fields(initial_path="a", data=data["a"], focused_out_truncate_fields=["a.b[i].c"]) == {
+        "b": [{"c": CUT_OFF_PLACEHOLDER}, {}, {}]}
+    assert truncate_fields_from_focused_out_fields(initial_path="", data={"x[": {"y": 1}, "z": [1]}, focused_out_truncate_fields=["x[.y", "z"]) == {
+        "x[": {"y": CUT_OFF_PLACEHOLDER}, "z": CUT_OFF_PLACEHOLDER}
 
     print("Assertions passed")
@@ -1,8 +1,205 @@
 import json
 import hashlib
+from typing import Any, Hashable, Iterable
+from lodash.dict_manipulation import to_path
 
+STREAM_CHUNK_SIZE = 64 * 1024
 
-def dict_to_sha256(input_dict: dict) -> str:
-    json_string = json.dumps(input_dict, sort_keys=True)  # sort keys for consistency of json strings
-    sha256_hash = hashlib.sha256(json_string.encode()).hexdigest()
-    return sha256_hash
+
+class _Tag:
+    __slots__ = ("name",)
+    # the repr is the same in every process, so frozen keys can be persisted (see `lodash.cache_store`)
+    _stable_repr = True
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return f"<{self.name}>"
+
+    def __reduce__(self):
+        return f"_{self.name.upper()}_TAG"
+
+
+_DICT_TAG = _Tag("dict")
+_LIST_TAG = _Tag("list")
+_SET_TAG = _Tag("set")
+_ATOMIC_TYPES = {str, int, float, bool, type(None)}
+
+
+def freeze(obj: Any) -> Hashable:
+    """
+    Converts nested dicts, lists and sets into an equivalent hashable value.
+
+    Dicts become frozensets of their items, so key order doesn't matter (like `sort_keys`
+    in `dict_to_sha256`), lists become tuples and sets frozensets; all of them are tagged,
+    so that e.g. a list and a tuple with the same items give different values.
+    Everything else is returned as is.
+
+    Example:
+        freeze({"b": [1, 2], "a": {3}}) == freeze({"a": {3}, "b": [1, 2]})  # True
+    """
+    cls = type(obj)
+    if cls in _ATOMIC_TYPES:
+        return obj
+    if cls is dict or isinstance(obj, dict):
+        return _DICT_TAG, frozenset([
+            (key, value if type(value) in _ATOMIC_TYPES else freeze(value)) for key, value in obj.items()
+        ])
+    if cls is list or isinstance(obj, list):
+        return _LIST_TAG, tuple([value if type(value) in _ATOMIC_TYPES else freeze(value) for value in obj])
+    if cls is tuple or isinstance(obj, tuple):
+        return tuple([value if type(value) in _ATOMIC_TYPES else freeze(value) for value in obj])
+    if isinstance(obj, (set, frozenset)):
+        return _SET_TAG, frozenset([freeze(value) for value in obj])
+    return obj
+
+
+_CANONICAL_ENCODER = json.JSONEncoder(sort_keys=True)
+
+
+def dict_to_sha256(input_dict: dict, stream: bool = False) -> str:
+    """
+    The SHA-256 of the canonical JSON (sorted keys) of `input_dict`.
+
+    With `stream`, the JSON is fed to the hash in chunks of about `STREAM_CHUNK_SIZE` as it
+    is encoded, instead of being built as one string first; the digest is the same.
+    This saves memory on big documents, but the pure-Python encoder it needs is slower.
+    """
+    if not stream:
+        json_string = json.dumps(input_dict, sort_keys=True)  # sort keys for consistency of json strings
+        sha256_hash = hashlib.sha256(json_string.encode()).hexdigest()
+        return sha256_hash
+
+    sha256 = hashlib.sha256()
+    chunks = []
+    size = 0
+    for chunk in _CANONICAL_ENCODER.iterencode(input_dict):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= STREAM_CHUNK_SIZE:
+            sha256.update("".join(chunks).encode())
+            chunks.clear()
+            size = 0
+    sha256.update("".join(chunks).encode())
+    return sha256.hexdigest()
+
+
+_encode_string = json.encoder.encode_basestring_ascii
+
+
+def _json_key(key: Any) -> bytes:
+    # dict keys the way json.dumps converts them
+    if isinstance(key, str):
+        return _encode_string(key).encode()
+    if key is None or isinstance(key, (bool, int, float)):
+        return _encode_string(json.dumps(key)).encode()
+    raise TypeError(f"keys must be str, int, float, bool or None, not {type(key).__name__}")
+
+
+def _first(item: tuple) -> Any:
+    return item[0]
+
+
+class MerkleHasher:
+    """
+    Hashes JSON-like data as a Merkle tree: the digest of a dict or list is the SHA-256 of the
+    digests of its items, and those of the dicts and lists are cached by identity.
+
+    After a change, call `invalidate` with the keypath of the changed value; the next `digest`
+    then rehashes only the containers along that path and reuses the cached digests of all
+    other subtrees. Containers which were mutated without `invalidate` keep their old digest.
+    Digests are stable across processes, and equal for data with equal canonical JSON, but
+    they differ from `dict_to_sha256`, which hashes the flat JSON.
+
+    The cache holds references to the hashed containers; `clear` releases them.
+
+    Example:
+        hasher = MerkleHasher()
+        hasher.digest(document)
+        document["sections"][3]["title"] = "Results"
+        hasher.invalidate(document, "sections[3].title")
+        hasher.digest(document)  # rehashes the document, its sections list and section 3
+    """
+
+    def __init__(self):
+        self._digests: dict[int, tuple[Any, bytes]] = {}
+
+    def __len__(self) -> int:
+        return len(self._digests)
+
+    def digest(self, obj: Any) -> str:
+        return self._digest(obj).hex()
+
+    def _digest(self, obj: Any) -> bytes:
+        digest = self._known_digest(obj)
+        if digest is not None:
+            return digest
+
+        # the containers being hashed, innermost last, each with its hash so far and its
+        # remaining items; a dict's items are its sorted (key bytes, value) pairs
+        stack = [self._open(obj)]
+        opened = {id(obj)}
+        while True:
+            container, sha256, items, is_dict = stack[-1]
+            for item in items:
+                if is_dict:
+                    key_bytes, item = item
+                    sha256.update(key_bytes)
+                digest = self._known_digest(item)
+                if digest is None:
+                    if id(item) in opened:
+                        raise ValueError("Circular reference detected")
+                    opened.add(id(item))
+                    stack.append(self._open(item))
+                    break
+                sha256.update(digest)
+            else:
+                digest = sha256.digest()
+                self._digests[id(container)] = (container, digest)
+                stack.pop()
+                if not stack:
+                    return digest
+                opened.discard(id(container))
+                stack[-1][1].update(digest)
+
+    def _known_digest(self, obj: Any) -> bytes | None:
+        # the digest of a value, unless it is a container which isn't cached yet
+        cls = type(obj)
+        if cls is dict or cls is list or cls is tuple or isinstance(obj, (dict, list, tuple)):
+            cached = self._digests.get(id(obj))
+            if cached is not None and cached[0] is obj:
+                return cached[1]
+            return None
+        if cls is str:
+            encoded = _encode_string(obj)
+        elif cls is int:
+            encoded = int.__repr__(obj)
+        else:
+            encoded = json.dumps(obj)
+        return hashlib.sha256(b"=" + encoded.encode()).digest()
+
+    @staticmethod
+    def _open(obj: dict | list | tuple) -> tuple:
+        if isinstance(obj, dict):
+            items = sorted(((_json_key(key), value) for key, value in obj.items()), key=_first)
+            return obj, hashlib.sha256(b"{"), iter(items), True
+        return obj, hashlib.sha256(b"["), iter(obj), False
+
+    def invalidate(self, root: Any, path: str | Iterable[str | int] = ()) -> None:
+        """
+        Drops the cached digests of `root` and of the containers along `path` (a keypath like
+        "a.b[0]" as in `dig`, or its segments), down to the value at its end.
+        """
+        segments = to_path(path) if isinstance(path, str) else list(path)
+        node = root
+        self._digests.pop(id(node), None)
+        for segment in segments:
+            try:
+                node = node[segment]
+            except (KeyError, IndexError, TypeError):
+                return
+            self._digests.pop(id(node), None)
+
+    def clear(self) -> None:
+        self._digests.clear()
@@ -1,172 +1,480 @@
+import functools
+import itertools
+import json
 import uuid
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+from typing import Callable
 from lodash.dict_manipulation import dig, dig_json_schema
+from lodash.dict_sha import dict_to_sha256
+from lodash.tree_walker import Path, Prune, iter_containers, path_to_keypath, root_path, transform, walk
 import jsonschema
 import copy
 
+VALIDATOR_CACHE_MAXSIZE = 256
 
-def add_types_to_json_schema(schema: dict) -> dict:
-    """Adds image, document, and reference type definitions to a JSON schema."""
 
-    # Add the type definitions if they don't exist
-    if "$defs" not in schema:
-        schema["$defs"] = {}
+class _FingerprintCache:
+    """A small thread-safe LRU mapping of schema fingerprints to prepared objects."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+NORMALIZED_SCHEMA_CACHE_MAXSIZE = 256
+
+_normalized_schemas = _FingerprintCache(NORMALIZED_SCHEMA_CACHE_MAXSIZE)
+_shared_schema_fingerprints = _FingerprintCache(NORMALIZED_SCHEMA_CACHE_MAXSIZE)
+
+
+def _schema_fingerprint(schema) -> str | None:
+    # Shared read-only schemas produced by this module remember their fingerprint
+    shared = _shared_schema_fingerprints.get(id(schema))
+    if shared is not None and shared[0] is schema:
+        return shared[1]
+
+    try:
+        return dict_to_sha256(schema)
+    except (TypeError, ValueError):  # not JSON-serializable, such a schema is not cached
+        return None
+
+
+_IMAGE_TYPE_DEFINITION = {
+    "type": "object",
+    "properties": {
+        "type": {
+            "type": "string",
+            "enum": ["image"]
+        },
+        "url": {
+            "type": "string",
+            "format": "uri"
+        }
+    },
+    "required": ["type", "url"]
+}
 
-    # Add image type definition
-    if "image" not in schema["$defs"]:
-        schema["$defs"]["image"] = {
+_DOCUMENT_TYPE_DEFINITION = {
+    "type": "object",
+    "properties": {
+        "type": {
+            "type": "string",
+            "enum": ["document"]
+        },
+        "contents": {
+            "type": "array",
+            "items": {
+                "type": "string"
+            }
+        },
+        "images": {
+            "type": "array",
+            "items": {
+                "$ref": "#/$defs/image"
+            }
+        },
+        "metadata": {
             "type": "object",
             "properties": {
-                "type": {
-                    "type": "string",
-                    "enum": ["image"]
-                },
-                "url": {
-                    "type": "string",
-                    "format": "uri"
-                }
-            },
-            "required": ["type", "url"]
+                "filename": {"type": "string"},
+                "created_at": {"type": "string", "format": "date-time"}
+            }
         }
+    },
+    "required": ["type", "contents"]
+}
 
-    # Add document type definition
-    if "document" not in schema["$defs"]:
-        schema["$defs"]["document"] = {
+_REFERENCE_TYPE_DEFINITION = {
+    "oneOf": [
+        {
             "type": "object",
             "properties": {
-                "type": {
+                "$ref": {
                     "type": "string",
-                    "enum": ["document"]
-                },
-                "contents": {
-                    "type": "array",
-                    "items": {
-                        "type": "string"
-                    }
-                },
-                "images": {
-                    "type": "array",
-                    "items": {
-                        "$ref": "#/$defs/image"
-                    }
-                },
-                "metadata": {
-                    "type": "object",
-                    "properties": {
-                        "filename": {"type": "string"},
-                        "created_at": {"type": "string", "format": "date-time"}
-                    }
                 }
             },
-            "required": ["type", "contents"]
+            "required": ["$ref"]
+        },
+        {
+            "type": "null"
         }
+    ]
+}
 
-    # Update reference type definition
-    if "reference" not in schema["$defs"]:
-        schema["$defs"]["reference"] = {
-            "oneOf": [
-                {
-                    "type": "object",
-                    "properties": {
-                        "$ref": {
-                            "type": "string",
-                        }
-                    },
-                    "required": ["$ref"]
-                },
-                {
-                    "type": "null"
-                }
-            ]
-        }
 
-    def replace_types(obj):
-        if isinstance(obj, dict):
-            if obj.get("type") == "image":
-                return {"$ref": "#/$defs/image"}
-            elif obj.get("type") == "document":
-                return {"$ref": "#/$defs/document"}
-            elif obj.get("type") == "reference":
-                return {"$ref": "#/$defs/reference"}
-            return {k: replace_types(v) for k, v in obj.items()}
-        elif isinstance(obj, list):
-            return [replace_types(item) for item in obj]
-        return obj
-
-    return replace_types(schema)
-
-def add_uid_to_dict(obj):
-    """Recursively adds a $uid field with a random UUID to all dictionaries."""
+_REPLACED_TYPES = {"image", "document", "reference"}
+
+
+def _replace_type(path: Path, obj):
     if isinstance(obj, dict):
-        if "$uid" not in obj:
-            obj["$uid"] = str(uuid.uuid4())
-        for k, v in obj.items():
-            add_uid_to_dict(v)
-    elif isinstance(obj, list):
-        for item in obj:
-            add_uid_to_dict(item)
+        type_name = obj.get("type")
+        if isinstance(type_name, str) and type_name in _REPLACED_TYPES:
+            return Prune({"$ref": f"#/$defs/{type_name}"})
+    return obj
+
+
+def _replace_types(obj):
+    return transform(obj, _replace_type, leaves=False)
+
+
+def _shared_typed_schema(schema: dict) -> dict:
+    # `add_types_to_json_schema` cached per schema content and shared between internal callers, so read-only
+    fingerprint = _schema_fingerprint(schema)
+    if fingerprint is not None:
+        normalized = _normalized_schemas.get(fingerprint)
+        if normalized is not None:
+            return normalized
+
+    # Add the type definitions if they don't exist
+    defs = dict(schema.get("$defs", {}))
+    defs.setdefault("image", _IMAGE_TYPE_DEFINITION)
+    defs.setdefault("document", _DOCUMENT_TYPE_DEFINITION)
+    defs.setdefault("reference", _REFERENCE_TYPE_DEFINITION)
+
+    # The rebuilt schema never shares containers with the input or the definitions above
+    normalized = _replace_types({**schema, "$defs": defs})
+
+    if fingerprint is not None:
+        _normalized_schemas.set(fingerprint, normalized)
+        normalized_fingerprint = _schema_fingerprint(normalized)
+        if normalized_fingerprint is not None:
+            _shared_schema_fingerprints.set(id(normalized), (normalized, normalized_fingerprint))
+    return normalized
+
+
+def add_types_to_json_schema(schema: dict) -> dict:
+    """Adds image, document, and reference type definitions to a JSON schema.
+
+    The given schema is not modified. The result is built once per schema content; every call
+    returns a fresh copy of it, which the caller may modify.
+    """
+    return transform(_shared_typed_schema(schema))
+
+class UidIndex:
+    """Maps every $uid in a document to its keypath and to the object that carries it.
+
+    The index is built in a single pass on first use, so passing an index that is never queried costs nothing.
+    It reflects the document as it was when it was built; use `add`, `discard` or `replace` after changing
+    the document. Like `find_path_by_uid`, the first occurrence of a duplicated $uid wins.
+    """
+
+    def __init__(self, data=None):
+        self._data = data
+        self._paths = None
+        self._nodes = None
+        self._uids = None
+
+    def _ensure_built(self):
+        if self._paths is None:
+            self._paths = {}
+            self._nodes = {}
+            self._uids = {}
+            if self._data is not None:
+                self._index(self._data, "")
+
+    def _index(self, obj, path):
+        paths = self._paths
+        nodes = self._nodes
+        uids = self._uids
+        stack = [(obj, path)]
+        while stack:
+            obj, path = stack.pop()
+            if isinstance(obj, dict):
+                uid = obj.get("$uid")
+                if uid is not None and uid not in paths:
+                    paths[uid] = path
+                    nodes[uid] = obj
+                    uids.setdefault(path, uid)
+                children = [
+                    (value, f"{path}.{key}" if path else key)
+                    for key, value in obj.items()
+                    if key != "$uid"
+                ]
+            elif isinstance(obj, list):
+                children = [
+                    (item, f"{path}[{index}]" if path else f"[{index}]")
+                    for index, item in enumerate(obj)
+                ]
+            else:
+                continue
+            stack.extend(reversed(children))
+
+    def path_of(self, uid) -> str | None:
+        """Returns the keypath of the object with the given $uid, or None if there is none."""
+        self._ensure_built()
+        return self._paths.get(uid)
+
+    def node_of(self, uid) -> dict | None:
+        """Returns the object with the given $uid, or None if there is none."""
+        self._ensure_built()
+        return self._nodes.get(uid)
+
+    def uid_at(self, path: str) -> str | None:
+        """Returns the $uid of the object located at `path`, or None if it has none."""
+        self._ensure_built()
+        return self._uids.get(path)
+
+    def __contains__(self, uid) -> bool:
+        self._ensure_built()
+        return uid in self._paths
+
+    def __len__(self) -> int:
+        self._ensure_built()
+        return len(self._paths)
+
+    def add(self, obj, path: str = ""):
+        """Indexes the $uid objects inside `obj`, which is located at `path` in the document."""
+        self._ensure_built()
+        self._index(obj, path)
+
+    def discard(self, path: str = ""):
+        """Drops every $uid located at `path` or below it."""
+        self._ensure_built()
+        if not path:
+            self._paths.clear()
+            self._nodes.clear()
+            self._uids.clear()
+            return
+
+        prefixes = (f"{path}.", f"{path}[")
+        stale = [uid for uid, uid_path in self._paths.items() if uid_path == path or uid_path.startswith(prefixes)]
+        for uid in stale:
+            uid_path = self._paths.pop(uid)
+            del self._nodes[uid]
+            if self._uids.get(uid_path) == uid:
+                del self._uids[uid_path]
+
+    def replace(self, path: str, obj):
+        """Re-indexes the subtree at `path` after it was replaced with `obj`."""
+        self.discard(path)
+        self.add(obj, path)
+
+
+def _new_uid() -> str:
+    return str(uuid.uuid4())
+
+
+def sequential_uids(prefix: str | None = None) -> Callable[[], str]:
+    """A uid factory for `add_uid_to_dict` which numbers uids after a prefix.
+
+    The prefix defaults to a random UUID, so the uids stay unique across documents and
+    processes while generating one costs a counter increment instead of a `uuid4()`.
+
+    Example:
+        add_uid_to_dict(data, uid_factory=sequential_uids())  # "3f2b...-0", "3f2b...-1", ...
+    """
+    if prefix is None:
+        prefix = uuid.uuid4().hex
+    counter = itertools.count()
+    return lambda: f"{prefix}-{next(counter)}"
+
+
+def _add_uids(obj, new_uid: Callable[[], str] = _new_uid):
+    for value in iter_containers(obj):
+        if isinstance(value, dict) and "$uid" not in value:
+            value["$uid"] = new_uid()
+    return obj
+
+
+def add_uid_to_dict(obj, uid_index: UidIndex | None = None, path: str = "", uid_factory: Callable[[], str] | None = None):
+    """Recursively adds a $uid field with a random UUID to all dictionaries.
+
+    Args:
+        obj: The dictionary or list to add the $uid fields to, in place
+        uid_index: An index to register the new uids in
+        path: The keypath of `obj` inside the indexed document
+        uid_factory: Generates the uids instead of `uuid4`, e.g. `sequential_uids()`
+
+    Returns:
+        The same object, with the $uid fields added
+    """
+    _add_uids(obj, uid_factory or _new_uid)
+    if uid_index is not None:
+        uid_index.add(obj, path)
     return obj
 
 
 def find_path_by_uid(obj, target_uid, current_path=""):
-    """Recursively searches for a specific $uid and returns its keypath.
+    """Searches for a specific $uid and returns its keypath.
 
     Args:
         obj: The dictionary or list to search through
         target_uid: The $uid value to find
-        current_path: The accumulated path (used in recursion)
+        current_path: The keypath of `obj`, which the result starts with
 
     Returns:
         str: The keypath to the object with the matching $uid, or None if not found
     """
-    if isinstance(obj, dict):
-        if obj.get("$uid") == target_uid:
-            return current_path
-
-        for key, value in obj.items():
-            # Build the new path segment
-            new_path = f"{current_path}.{key}" if current_path else key
-            # Skip the $uid key itself to avoid unnecessary recursion
-            if key != "$uid":
-                result = find_path_by_uid(value, target_uid, new_path)
-                if result is not None:
-                    return result
-
-    elif isinstance(obj, list):
-        for index, item in enumerate(obj):
-            # For lists, use array notation [index]
-            new_path = f"{current_path}[{index}]" if current_path else f"[{index}]"
-            result = find_path_by_uid(item, target_uid, new_path)
-            if result is not None:
-                return result
+    for path, value in walk(obj, path=root_path(current_path), leaves=False):
+        if isinstance(value, dict) and value.get("$uid") == target_uid and not _is_under_uid(path):
+            return path_to_keypath(path)
     return None
 
 
+def _is_under_uid(path: Path) -> bool:
+    # whether the node is inside the value of a $uid key, which is not searched
+    while path[2] is not None:
+        path, key, is_index = path
+        if is_index is False and key == "$uid":
+            return True
+    return False
+
+
+_UID_KEYS = frozenset(["$uid"])
+
+
 def remove_uids(obj):
+    return transform(obj, omit=_UID_KEYS)
+
+
+class UidlessMapping(Mapping):
+    """A read-only view of a dict without its $uid key; nested dicts and lists are viewed the same way.
+
+    Nothing is copied, so the view reflects later changes of the dict.
+    """
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data: dict):
+        self._data = data
+
+    def __getitem__(self, key):
+        if key == "$uid":
+            raise KeyError(key)
+        return without_uids(self._data[key])
+
+    def __iter__(self):
+        return (key for key in self._data if key != "$uid")
+
+    def __len__(self) -> int:
+        return len(self._data) - ("$uid" in self._data)
+
+    def __contains__(self, key) -> bool:
+        return key != "$uid" and key in self._data
+
+    def items(self):
+        return ((key, without_uids(value)) for key, value in self._data.items() if key != "$uid")
+
+    def __repr__(self):
+        return f"UidlessMapping({dict(self.items())!r})"
+
+
+class UidlessSequence(Sequence):
+    """A read-only view of a list whose dicts and lists are viewed without $uid keys, see `UidlessMapping`."""
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data: list):
+        self._data = data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return UidlessSequence(self._data[index])
+        return without_uids(self._data[index])
+
+    def __iter__(self):
+        return (without_uids(item) for item in self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence) or isinstance(other, (str, bytes)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __repr__(self):
+        return f"UidlessSequence({list(self)!r})"
+
+
+def without_uids(obj):
+    """A zero-copy view of `obj` without $uid keys, the lazy counterpart of `remove_uids`.
+
+    Dicts and lists are wrapped in `UidlessMapping` and `UidlessSequence`, everything else is returned as is.
+    Use `UidlessJSONEncoder` to serialize the views.
+    """
     if isinstance(obj, dict):
-        obj = {k: v for k, v in obj.items() if k != "$uid"}
-        return {k: remove_uids(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [remove_uids(item) for item in obj]
+        return UidlessMapping(obj)
+    if isinstance(obj, list):
+        return UidlessSequence(obj)
     return obj
 
-def clean_uids(func):
-    """Decorator that removes $uid keys from the returned dictionary."""
 
-    async def wrapper(*args, **kwargs):
-        result = await func(*args, **kwargs)
-        res = remove_uids(result)
-        return res
+class UidlessJSONEncoder(json.JSONEncoder):
+    """A JSON encoder which leaves out $uid keys while encoding, without copying the data first.
+
+    Example:
+        json.dumps(data_with_uids, cls=UidlessJSONEncoder)
+    """
+
+    def default(self, o):
+        # one level is copied at a time, with the nested dicts and lists wrapped again
+        if isinstance(o, UidlessMapping):
+            return {
+                key: without_uids(value) if isinstance(value, (dict, list)) else value
+                for key, value in o._data.items() if key != "$uid"
+            }
+        if isinstance(o, UidlessSequence):
+            return [without_uids(item) if isinstance(item, (dict, list)) else item for item in o._data]
+        return super().default(o)
+
+    def iterencode(self, o, _one_shot=False):
+        return super().iterencode(without_uids(o), _one_shot)
+
+
+def clean_uids(func=None, *, lazy: bool = False):
+    """Decorator that removes $uid keys from the returned dictionary.
+
+    With `lazy`, the result is returned as a `without_uids` view instead of a cleaned copy,
+    which is cheaper when the response is serialized right away (see `UidlessJSONEncoder`).
+    """
+    clean = without_uids if lazy else remove_uids
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            result = await func(*args, **kwargs)
+            res = clean(result)
+            return res
 
-    return wrapper
+        return wrapper
 
+    return decorator if func is None else decorator(func)
 
-def check_for_circular_reference(target_path: str, source_path: str, full_data: dict, visited=None) -> bool:
+def check_for_circular_reference(target_path: str, source_path: str, full_data: dict, visited=None, uid_index: UidIndex | None = None) -> bool:
     """
     Check if adding a reference would create a circular dependency.
     Returns True if a circular reference is detected.
     """
     if visited is None:
         visited = set()
+    if uid_index is None:
+        uid_index = UidIndex(full_data)
 
     # Split paths into components for more accurate checking
     target_parts = target_path.split('.')
@@ -190,8 +498,8 @@ def check_for_circular_reference(target_path: str, source_path: str, full_data:
     def check_value(value):
         if isinstance(value, dict) and "$ref" in value:
             ref_uid = value["$ref"]
-            ref_path = find_path_by_uid(full_data, ref_uid)
-            if ref_path and check_for_circular_reference(ref_path, source_path, full_data, visited):
+            ref_path = uid_index.path_of(ref_uid)
+            if ref_path and check_for_circular_reference(ref_path, source_path, full_data, visited, uid_index):
                 return True
         elif isinstance(value, dict):
             for v in value.values():
@@ -217,21 +525,235 @@ def check_for_circular_reference(target_path: str, source_path: str, full_data:
     return False
 
 
-def resolve_references(obj, *, path_data, all_data, current_path="", _first_occurrence_paths=None):
+def _ancestor_keypaths(path: str):
+    """Yields `path` and then every keypath above it, up to the root ""."""
+    while True:
+        yield path
+        if not path:
+            return
+        cut = max(path.rfind('.'), path.rfind('['))
+        path = path[:cut] if cut > 0 else ""
+
+
+def _strongly_connected_components(nodes, successors) -> list[list]:
+    """Tarjan's algorithm without recursion. Components come out in reverse topological order."""
+    index = {}
+    low = {}
+    on_stack = set()
+    stack = []
+    components = []
+
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(successors[root]))]
+
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(successors[child])))
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+
+    return components
+
+
+class ReferenceGraph:
+    """Reachability between $uid objects through the $ref values nested in them.
+
+    An object reaches every object referenced from anywhere inside it, and reachability is transitive.
+    The graph is built in one pass over the document. The transitive closure is kept for the referenced
+    objects only; the reach of any other object is gathered from the references below it when asked for.
+    `add_reference` updates the closure of every object reaching the new reference, which is linear in the
+    number of objects per reference in the worst case, and `remove_reference` rebuilds the whole closure.
+
+    Args:
+        all_data: The complete data structure with $uid and $ref values
+        uid_index: A `UidIndex` of all_data, built on demand when not given
+    """
+
+    def __init__(self, all_data, uid_index: UidIndex | None = None):
+        self.uid_index = uid_index if uid_index is not None else UidIndex(all_data)
+        self._references = []
+        stack = [(all_data, "")]
+        while stack:
+            obj, path = stack.pop()
+            if isinstance(obj, dict):
+                if "$ref" in obj:
+                    self._references.append((path, obj["$ref"]))
+                stack.extend(
+                    (value, f"{path}.{key}" if path else key)
+                    for key, value in obj.items()
+                    if key != "$uid"
+                )
+            elif isinstance(obj, list):
+                stack.extend(
+                    (item, f"{path}[{index}]" if path else f"[{index}]")
+                    for index, item in enumerate(obj)
+                )
+        self._rebuild()
+
+    def _rebuild(self):
+        self._successors = {}
+        self._reach = {}
+        self._reached_by = {}
+        self._targets_below = {}
+        self._components = None
+
+        for path, target in self._references:
+            if target in self.uid_index:
+                self._successors.setdefault(target, set())
+                for ancestor in _ancestor_keypaths(path):
+                    self._targets_below.setdefault(ancestor, []).append(target)
+
+        for node, successors in self._successors.items():
+            successors.update(self._targets_below.get(self.uid_index.path_of(node), ()))
+
+        for component in self._get_components():
+            reach = set()
+            for node in component:
+                for successor in self._successors[node]:
+                    reach.add(successor)
+                    reach.update(self._reach.get(successor, ()))
+            if len(component) > 1 or component[0] in self._successors[component[0]]:
+                reach.update(component)
+            for node in component:
+                self._reach[node] = set(reach)
+
+        for node in self._successors:
+            self._reached_by.setdefault(node, set())
+        for node, reach in self._reach.items():
+            for target in reach:
+                self._reached_by[target].add(node)
+
+    def _get_components(self) -> list[list]:
+        if self._components is None:
+            self._components = _strongly_connected_components(self._successors, self._successors)
+        return self._components
+
+    def _enclosing_nodes(self, path: str):
+        for ancestor in _ancestor_keypaths(path):
+            uid = self.uid_index.uid_at(ancestor)
+            if uid is not None and uid in self._successors:
+                yield uid
+
+    def _add_edge(self, source, target):
+        if target in self._successors[source]:
+            return
+        self._successors[source].add(target)
+        self._components = None
+
+        targets = self._reach[target] | {target}
+        for node in self._reached_by[source] | {source}:
+            added = targets - self._reach[node]
+            if added:
+                self._reach[node] |= added
+                for reached in added:
+                    self._reached_by[reached].add(node)
+
+    def _reach_of(self, uid, path: str) -> set:
+        reach = self._reach.get(uid)
+        if reach is None:
+            # objects that are never referenced aren't in the closure
+            reach = set()
+            for target in self._targets_below.get(path, ()):
+                reach.add(target)
+                reach |= self._reach[target]
+        return reach
+
+    def reaches(self, source_uid, target_uid) -> bool:
+        """Returns True if the object `source_uid` references `target_uid`, directly or through other objects."""
+        source_path = self.uid_index.path_of(source_uid)
+        if source_path is None:
+            return False
+        return target_uid in self._reach_of(source_uid, source_path)
+
+    def would_create_cycle(self, source_path: str, target_uid) -> bool:
+        """Returns True if a reference to `target_uid` placed at `source_path` would create a circular reference."""
+        target_path = self.uid_index.path_of(target_uid)
+        if target_path is None:
+            return False
+        if target_path in _ancestor_keypaths(source_path):
+            return True
+
+        reach = self._reach_of(target_uid, target_path)
+        return any(node in reach for node in self._enclosing_nodes(source_path))
+
+    def add_reference(self, source_path: str, target_uid):
+        """Records a reference to `target_uid` placed at `source_path`."""
+        self._references.append((source_path, target_uid))
+        if target_uid not in self.uid_index:
+            return
+
+        if target_uid not in self._successors:
+            self._successors[target_uid] = set()
+            self._reach[target_uid] = set()
+            self._reached_by[target_uid] = set()
+            for target in self._targets_below.get(self.uid_index.path_of(target_uid), ()):
+                self._add_edge(target_uid, target)
+
+        for ancestor in _ancestor_keypaths(source_path):
+            self._targets_below.setdefault(ancestor, []).append(target_uid)
+        for node in list(self._enclosing_nodes(source_path)):
+            self._add_edge(node, target_uid)
+
+    def remove_reference(self, source_path: str, target_uid):
+        """Forgets a reference recorded at `source_path`. Reachability is recomputed from scratch."""
+        self._references.remove((source_path, target_uid))
+        self._rebuild()
+
+    def find_cycles(self) -> list[list]:
+        """Returns every group of objects that reference each other in a cycle, as lists of $uid values."""
+        return [
+            component
+            for component in self._get_components()
+            if len(component) > 1 or component[0] in self._successors[component[0]]
+        ]
+
+
+def resolve_references(obj, *, path_data, all_data, current_path="", _first_occurrence_paths=None, uid_index: UidIndex | None = None, _copy_on_write=False):
     """Resolves references in a data structure by replacing $ref UIDs with paths.
 
+    Inlined targets share their unchanged parts with `all_data` instead of being deep-copied;
+    copy the result before mutating it.
+
     Args:
         obj: The object to resolve references in
         path_data: The data from the current path context
         all_data: The complete data structure
         current_path: The current path being processed
         _first_occurrence_paths: Dictionary tracking first occurrences of references
+        uid_index: A `UidIndex` of all_data, built on demand when not given
 
     Returns:
         The object with resolved references, with references in string format "$ref:path"
     """
     if _first_occurrence_paths is None:
         _first_occurrence_paths = {}
+    if uid_index is None:
+        uid_index = UidIndex(all_data)
 
     if isinstance(obj, dict):
         if "$ref" in obj:
@@ -239,95 +761,157 @@ def resolve_references(obj, *, path_data, all_data, current_path="", _first_occu
             if ref_uid in _first_occurrence_paths:
                 return f"$ref:{_first_occurrence_paths[ref_uid]}"
 
-            target_path = find_path_by_uid(all_data, ref_uid)
+            target_path = uid_index.path_of(ref_uid)
             read_from_data = dig(path_data, target_path)
             read_from_all_data = dig(all_data, target_path)
 
-            if read_from_data is not None and read_from_data == read_from_all_data:
+            if read_from_data is not None and (read_from_data is read_from_all_data or read_from_data == read_from_all_data):
                 _first_occurrence_paths[ref_uid] = target_path
                 return f"$ref:{_first_occurrence_paths[ref_uid]}"
             else:
                 _first_occurrence_paths[ref_uid] = current_path
-                read_from_all_data_copy = copy.deepcopy(read_from_all_data)
                 result = resolve_references(
-                    read_from_all_data_copy,
+                    read_from_all_data,
                     path_data=path_data,
                     all_data=all_data,
                     current_path=current_path,
-                    _first_occurrence_paths=_first_occurrence_paths
+                    _first_occurrence_paths=_first_occurrence_paths,
+                    uid_index=uid_index,
+                    _copy_on_write=True
                 )
                 return result
         else:
+            result = obj
             for key, value in obj.items():
-                obj[key] = resolve_references(
+                resolved = resolve_references(
                     value,
                     path_data=path_data,
                     all_data=all_data,
                     current_path=f"{current_path}.{key}" if current_path else key,
-                    _first_occurrence_paths=_first_occurrence_paths
+                    _first_occurrence_paths=_first_occurrence_paths,
+                    uid_index=uid_index,
+                    _copy_on_write=_copy_on_write
                 )
+                if resolved is not value:
+                    if _copy_on_write and result is obj:
+                        result = dict(obj)
+                    result[key] = resolved
+            return result
 
     elif isinstance(obj, list):
+        result = obj
         for i, item in enumerate(obj):
-            obj[i] = resolve_references(
+            resolved = resolve_references(
                 item,
                 path_data=path_data,
                 all_data=all_data,
                 current_path=f"{current_path}[{i}]" if current_path else f"[{i}]",
-                _first_occurrence_paths=_first_occurrence_paths
+                _first_occurrence_paths=_first_occurrence_paths,
+                uid_index=uid_index,
+                _copy_on_write=_copy_on_write
             )
+            if resolved is not item:
+                if _copy_on_write and result is obj:
+                    result = list(obj)
+                result[i] = resolved
+        return result
 
     return obj
 
 
 
-def validate_and_clean_references(all_data, data):
+def validate_and_clean_references(all_data, data, uid_index: UidIndex | None = None):
     """Recursively checks all references and nullifies those pointing to non-existent objects."""
+    if uid_index is None:
+        uid_index = UidIndex(all_data)
+
     if isinstance(data, dict):
         for key, value in list(data.items()):  # Use list to avoid dictionary size change during iteration
             if isinstance(value, dict) and "$ref" in value:
                 ref_uid = value["$ref"]
-                ref_path = find_path_by_uid(all_data, ref_uid)
-                if ref_path is None:
+                if ref_uid not in uid_index:
                     data[key] = None
             else:
-                validate_and_clean_references(all_data=all_data, data=value)
+                validate_and_clean_references(all_data=all_data, data=value, uid_index=uid_index)
     elif isinstance(data, list):
         for i, item in enumerate(data):
             if isinstance(item, dict) and "$ref" in item:
                 ref_uid = item["$ref"]
-                ref_path = find_path_by_uid(all_data, ref_uid)
-                if ref_path is None:
+                if ref_uid not in uid_index:
                     data[i] = None
             else:
-                validate_and_clean_references(all_data=all_data, data=item)
+                validate_and_clean_references(all_data=all_data, data=item, uid_index=uid_index)
     return data
 
 
 
-def validate_against_schema(data: dict | list, schema: dict) -> tuple[bool, str]:
+_validators = _FingerprintCache(VALIDATOR_CACHE_MAXSIZE)
+
+
+def _get_validator(schema, trusted: bool):
+    """Returns a prepared validator for the schema, or None when the schema itself is invalid."""
+    fingerprint = _schema_fingerprint(schema)
+    entry = _validators.get(fingerprint) if fingerprint is not None else None
+    if entry is not None:
+        validator, checked = entry
+        if checked or trusted:
+            return validator
+
+    cls = jsonschema.validators.validator_for(schema)
+    if not trusted:
+        try:
+            cls.check_schema(schema)
+        except jsonschema.SchemaError:
+            validator = None
+        else:
+            validator = cls(copy.deepcopy(schema))
+    else:
+        validator = cls(copy.deepcopy(schema))
+
+    if fingerprint is not None:
+        _validators.set(fingerprint, (validator, not trusted))
+    return validator
+
+
+def invalidate_validator(schema: dict):
+    """Drops the cached validator prepared for this schema."""
+    fingerprint = _schema_fingerprint(schema)
+    if fingerprint is not None:
+        _validators.pop(fingerprint)
+
+
+def clear_validator_cache():
+    """Drops all cached validators."""
+    _validators.clear()
+
+
+def validate_against_schema(data: dict | list, schema: dict, *, trusted: bool = False) -> tuple[bool, str]:
     """Validates data against JSON schema.
 
+    Validators are prepared once per distinct schema and kept in a bounded LRU cache.
+
     Args:
         data: The data to validate
         schema: The JSON schema to validate against
+        trusted: Skip checking the schema against its metaschema
 
     Returns:
         tuple[bool, str]: (is_valid, error_message)
     """
     ok_message = "validation is passed"
-    try:
-        jsonschema.validate(data, schema)
-        return True, ok_message
-    except jsonschema.ValidationError as e:
-        return False, str(e)
-    except jsonschema.SchemaError as e:  # seems like an internal exception of jsonschema
+    validator = _get_validator(schema, trusted)
+    if validator is None:  # the schema is invalid, seems like an internal exception of jsonschema
         return True, ok_message
 
+    error = jsonschema.exceptions.best_match(validator.iter_errors(data))
+    if error is not None:
+        return False, str(error)
+    return True, ok_message
+
 
 def extract_references(data) -> list[dict]:
     """
-    Recursively extracts all references from the data.
+    Extracts all references from the data, in the order they appear in it.
 
     Args:
         data: The data to extract references from (can be dict, list, or primitive)
@@ -335,59 +919,137 @@ def extract_references(data) -> list[dict]:
     Returns:
         list[dict]: List of reference objects (dicts with $ref key)
     """
-    references = []
+    return [value for value in iter_containers(data) if isinstance(value, dict) and "$ref" in value]
 
-    if isinstance(data, dict):
-        # If this is a reference, add it to the list
-        if "$ref" in data:
-            references.append(data)
-        # Recursively check all values
-        for value in data.values():
-            references.extend(extract_references(value))
 
-    elif isinstance(data, list):
-        # Recursively check all items in the list
-        for item in data:
-            references.extend(extract_references(item))
+def _validate_with_references(keypath, global_schema, all_data, uid_index, first_error_only) -> list[tuple[str, str]]:
+    """Validates the keypath and everything it references, each keypath once, and returns the failures.
+
+    Referenced keypaths are validated before the data that references them, in the order of its references.
+    A keypath that is referenced again while it is still being validated is part of a reference cycle
+    and is not entered a second time.
+    """
+    done = set()
+    in_progress = set()
+    missing = set()
+    failures = []
+    stack = []
+
+    def _enter(path) -> bool:
+        schema = dig_json_schema(global_schema, path)
+        if schema is None:
+            message = f"Schema not found for path '{path}'"
+        else:
+            data = dig(all_data, path)
+            if data is not None:
+                in_progress.add(path)
+                stack.append((path, schema, data, iter(extract_references(data))))
+                return True
+            message = f"Data not found at path '{path}'"
+
+        done.add(path)
+        failures.append((path, message))
+        return False
+
+    if not _enter(keypath) and first_error_only:
+        return failures
 
-    return references
+    while stack:
+        path, schema, data, references = stack[-1]
+        for ref in references:
+            ref_path = uid_index.path_of(ref["$ref"])
+            if ref_path is None:
+                if ref["$ref"] not in missing:
+                    missing.add(ref["$ref"])
+                    failures.append((path, f"Reference target '{ref['$ref']}' not found"))
+                    if first_error_only:
+                        return failures
+                continue
+            if ref_path in done or ref_path in in_progress:
+                continue
+            if _enter(ref_path):
+                break
+            if first_error_only:
+                return failures
+        else:
+            stack.pop()
+            in_progress.discard(path)
+            done.add(path)
+            is_valid, message = validate_against_schema(data, _shared_typed_schema(schema))
+            if not is_valid:
+                failures.append((path, message))
+                if first_error_only:
+                    return failures
+
+    return failures
 
 
 def validate_json_schema_with_references(
     keypath: str,
     global_schema: dict,
-    all_data: dict
+    all_data: dict,
+    uid_index: UidIndex | None = None
 ) -> tuple[bool, str]:
     """
     Validates references and other data against the schema.
 
+    Every referenced keypath is validated once, however many times it is referenced, and reference
+    cycles are not followed more than once.
+
     Args:
         keypath (str): Path to the data to validate.
         global_schema (dict): The complete JSON schema used to validate objects.
         all_data (dict): Complete data object containing all possible reference targets.
+        uid_index (UidIndex): Index of all_data, built on demand when not given.
 
     Returns:
-        tuple[bool, str]: (is_valid, error_message)
+        tuple[bool, str]: (is_valid, error_message) for the first error found
     """
-    # Get schema and data for the keypath
-    schema = dig_json_schema(global_schema, keypath)
-    if schema is None:
-        return False, f"Schema not found for path '{keypath}'"
-    data = dig(all_data, keypath)
-    if data is None:
-        return False, f"Data not found at path '{keypath}'"
-
-    # Extract all references from the data
-    references = extract_references(data)
-    if not references:
-        schema = add_types_to_json_schema(schema)
-        res = validate_against_schema(data, schema)
-        return res
-    else:
-        for ref in references:
-            ref_path = find_path_by_uid(all_data, ref["$ref"])
-            is_valid, message = validate_json_schema_with_references(keypath=ref_path, global_schema=global_schema, all_data=all_data)
-            if not is_valid:
-                return False, message
-    schema = add_types_to_json_schema(schema)
-    return validate_against_schema(data, schema)
+    if uid_index is None:
+        uid_index = UidIndex(all_data)
+
+    failures = _validate_with_references(keypath, global_schema, all_data, uid_index, first_error_only=True)
+    if failures:
+        return False, failures[0][1]
+    return True, "validation is passed"
+
+
+def collect_json_schema_reference_errors(
+    keypath: str,
+    global_schema: dict,
+    all_data: dict,
+    uid_index: UidIndex | None = None
+) -> list[tuple[str, str]]:
+    """
+    Validates references and other data against the schema like `validate_json_schema_with_references`,
+    but goes on after the first error.
+
+    Args:
+        keypath (str): Path to the data to validate.
+        global_schema (dict): The complete JSON schema used to validate objects.
+        all_data (dict): Complete data object containing all possible reference targets.
+        uid_index (UidIndex): Index of all_data, built on demand when not given.
+
+    Returns:
+        list[tuple[str, str]]: (keypath, error_message) for every failed keypath, empty when all data is valid
+    """
+    if uid_index is None:
+        uid_index = UidIndex(all_data)
+
+    return _validate_with_references(keypath, global_schema, all_data, uid_index, first_error_only=False)
+
+
+if __name__ == '__main__':
+    doc = {'a': {'$uid': 'A', 'x': {'$ref': 'B'}}, 'b': {'$uid': 'B', 'y': {'$ref': 'C'}}, 'c': {'$uid': 'C'}}
+    graph = ReferenceGraph(doc)
+    # A is never referenced, but still reaches what it references
+    assert graph.reaches('A', 'B') and graph.reaches('A', 'C') and graph.reaches('B', 'C')
+    assert not graph.reaches('B', 'A') and not graph.reaches('C', 'B') and not graph.reaches('missing', 'B')
+    assert graph.would_create_cycle('c.z', 'A') and not graph.would_create_cycle('a.z', 'C')
+    assert not graph.find_cycles()
+    graph.add_reference('c.z', 'A')
+    assert graph.reaches('C', 'B') and graph.reaches('A', 'A')
+    assert sorted(graph.find_cycles()[0]) == ['A', 'B', 'C']
+    graph.remove_reference('c.z', 'A')
+    assert not graph.reaches('C', 'A') and graph.reaches('A', 'C')
+    print("Assertions passed")
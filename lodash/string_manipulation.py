@@ -1,5 +1,6 @@
 import re
 import textwrap
+from functools import lru_cache
 from types import FunctionType, LambdaType
 from typing import Literal, Any
 
@@ -100,33 +101,232 @@ def remove_quotes(text: str) -> str:
 
     return text.strip('\n')
 
-def split_keypath(path: str):
+KEYPATHS_MAXSIZE = 4096
+# the most `(state, key)` transitions a `KeyPathMatcher` remembers before starting over
+MATCHER_TRANSITIONS_MAXSIZE = 4096
+_KEYPATH_PART_PATTERN = re.compile(r'\[.*?\]|[^\[\]]+')
+_INDEX_PART_PATTERN = re.compile(r'\[-?\d+\]$')
+_KEY_SPECIAL_CHARACTERS = re.compile(r'[.\[\]]')
+
+
+def _split_keypath_uncached(path: str) -> tuple[str, ...]:
     parts = path.split('.')
     subparts = []
     for p in parts:
-        subparts.extend(re.findall(r'\[.*?\]|[^\[\]]+', p))
-    return subparts
+        subparts.extend(_KEYPATH_PART_PATTERN.findall(p))
+    return tuple(subparts)
 
 
-def match_keypath(template: str, specific: str) -> bool:
-    template_parts = split_keypath(template)
-    specific_parts = split_keypath(specific)
+@lru_cache(maxsize=KEYPATHS_MAXSIZE)
+def _split_keypath(path: str) -> tuple[str, ...]:
+    if '[' not in path and ']' not in path:
+        return tuple(part for part in path.split('.') if part)
+    return _split_keypath_uncached(path)
 
-    if len(template_parts) == 0:
-        return True
 
-    if len(template_parts) > len(specific_parts):
-        return False
+def split_keypath(path: str):
+    if not isinstance(path, str):
+        return list(_split_keypath_uncached(path))
+    return list(_split_keypath(path))
+
+
+def _keypath_parts(specific: str | list | tuple) -> list | tuple:
+    if isinstance(specific, str):
+        return _split_keypath(specific)
+    if isinstance(specific, (list, tuple)):
+        return specific
+    return _split_keypath_uncached(specific)
+
+
+class KeyPathTemplate:
+    """
+    A keypath template (as in `match_keypath`) parsed once.
+
+    `[i]`-like parts match any index and a template matches every path it is a prefix of.
+    Use `compile_keypath_template` to get a cached instance.
+
+    Example:
+        template = compile_keypath_template("list[i].item")
+        template.matches("list[2].item.name")  # True
+        template.matches(["list", "[2]", "item"])  # True
+        template.matches(["list", 2, "item"])  # True, ints are indexes
+    """
+
+    __slots__ = ("template", "parts", "_checks")
+
+    def __init__(self, template: str):
+        self.template = template
+        self.parts = _split_keypath(template) if isinstance(template, str) else _split_keypath_uncached(template)
+        self._checks = tuple((part.startswith('['), part) for part in self.parts)
+
+    def __repr__(self):
+        return f"KeyPathTemplate({self.template!r})"
+
+    def matches(self, specific: str | list | tuple) -> bool:
+        """
+        Args:
+            specific: a keypath, or its parts as returned by `split_keypath`; ints are treated as indexes.
+        """
+        specific = _keypath_parts(specific)
+        if len(self._checks) > len(specific):
+            return False
 
-    for t_part, s_part in zip(template_parts, specific_parts):
-        if t_part.startswith('['):
-            if not re.match(r'\[-?\d+\]$', s_part):
+        for (is_index, t_part), s_part in zip(self._checks, specific):
+            if is_index:
+                if isinstance(s_part, int):
+                    continue
+                if not _INDEX_PART_PATTERN.match(s_part):
+                    return False
+                continue
+            if t_part != s_part:
                 return False
-            continue
-        if t_part != s_part:
-            return False
 
-    return True
+        return True
+
+
+@lru_cache(maxsize=KEYPATHS_MAXSIZE)
+def _compile_keypath_template(template: str) -> KeyPathTemplate:
+    return KeyPathTemplate(template)
+
+
+def compile_keypath_template(template: str | KeyPathTemplate) -> KeyPathTemplate:
+    if isinstance(template, KeyPathTemplate):
+        return template
+    if not isinstance(template, str):
+        return KeyPathTemplate(template)
+    return _compile_keypath_template(template)
+
+
+def match_keypath(template: str, specific: str) -> bool:
+    return compile_keypath_template(template).matches(specific)
+
+class KeyPathMatcher:
+    """
+    Matches keypaths against many templates (as in `match_keypath`) at once.
+
+    The templates are compiled into a trie of parts with `[i]` wildcards, and a path is
+    matched part by part: a state describes where every template can still be, so it can
+    be carried down a tree and subtrees that no template can reach are detected early.
+
+    Use `compile_keypath_matcher` to get a cached instance.
+
+    Example:
+        matcher = KeyPathMatcher(["list[i].item", "meta"])
+        matcher.matching("list[0].item")  # ["list[i].item"]
+        state = matcher.advance_key(matcher.start, "list")
+        state = matcher.advance_index(state)
+        matcher.is_match(matcher.advance_key(state, "item"))  # True
+    """
+
+    MATCH = "match"
+    DEAD = ()
+
+    def __init__(self, templates: list[str]):
+        self.templates = list(templates)
+        self._children: list[dict[str, int]] = [{}]
+        self._wildcards: list[int | None] = [None]
+        self._ends: dict[int, list[int]] = {}
+        self._transitions: dict[tuple, tuple | str] = {}
+        for number, template in enumerate(self.templates):
+            node = 0
+            for part in compile_keypath_template(template).parts:
+                if part.startswith('['):
+                    if self._wildcards[node] is None:
+                        self._wildcards[node] = self._new_node()
+                    node = self._wildcards[node]
+                else:
+                    child = self._children[node].get(part)
+                    if child is None:
+                        child = self._children[node][part] = self._new_node()
+                    node = child
+            self._ends.setdefault(node, []).append(number)
+        self.start = self.MATCH if 0 in self._ends else (0,)
+
+    def _new_node(self) -> int:
+        self._children.append({})
+        self._wildcards.append(None)
+        return len(self._children) - 1
+
+    def _next_nodes(self, nodes: tuple, part: str | int) -> tuple:
+        if isinstance(part, int) or part.startswith('['):
+            if not isinstance(part, int) and not _INDEX_PART_PATTERN.match(part):
+                return self.DEAD
+            return tuple(self._wildcards[node] for node in nodes if self._wildcards[node] is not None)
+        return tuple(self._children[node][part] for node in nodes if part in self._children[node])
+
+    def _advance_part(self, state: tuple | str, part: str | int) -> tuple | str:
+        if state == self.MATCH or not state:
+            return state
+        nodes = self._next_nodes(state, part)
+        if any(node in self._ends for node in nodes):
+            return self.MATCH
+        return nodes
+
+    def advance(self, state: tuple | str, parts: list[str]) -> tuple | str:
+        for part in parts:
+            state = self._advance_part(state, part)
+        return state
+
+    def advance_key(self, state: tuple | str, key: str) -> tuple | str:
+        """The state after appending `.key` to the path; `key` may contain dots."""
+        if state == self.MATCH or not state:
+            return state
+        transition = (state, key)
+        result = self._transitions.get(transition)
+        if result is None:
+            if _KEY_SPECIAL_CHARACTERS.search(key):
+                result = self.advance(state, _split_keypath(key))
+            else:
+                result = self._advance_part(state, key) if key else state
+            # keys come from documents, so the memo is bounded for a matcher cached for the process
+            if len(self._transitions) >= MATCHER_TRANSITIONS_MAXSIZE:
+                self._transitions.clear()
+            self._transitions[transition] = result
+        return result
+
+    def advance_index(self, state: tuple | str) -> tuple | str:
+        """The state after appending `[i]` to the path."""
+        return self._advance_part(state, '[0]')
+
+    def is_match(self, state: tuple | str) -> bool:
+        return state == self.MATCH
+
+    def is_dead(self, state: tuple | str) -> bool:
+        return not state
+
+    def matches(self, specific: str | list | tuple) -> bool:
+        """Whether any of the templates matches the path, like `match_keypath`."""
+        return self.advance(self.start, _keypath_parts(specific)) == self.MATCH
+
+    def matching(self, specific: str | list | tuple) -> list[str]:
+        """All templates matching the path, in their original order, found in one pass."""
+        matched = list(self._ends.get(0, ()))
+        nodes = (0,)
+        for part in _keypath_parts(specific):
+            nodes = self._next_nodes(nodes, part)
+            if not nodes:
+                break
+            for node in nodes:
+                matched.extend(self._ends.get(node, ()))
+        return [self.templates[number] for number in sorted(matched)]
+
+
+@lru_cache(maxsize=KEYPATHS_MAXSIZE)
+def _compile_keypath_matcher(templates: tuple) -> KeyPathMatcher:
+    return KeyPathMatcher(templates)
+
+
+def compile_keypath_matcher(templates: list[str] | tuple[str, ...]) -> KeyPathMatcher:
+    try:
+        return _compile_keypath_matcher(tuple(templates))
+    except TypeError:
+        return KeyPathMatcher(templates)
+
+
+def match_keypaths(templates: list[str], specific: str | list | tuple) -> list[str]:
+    """The templates (as in `match_keypath`) matching a keypath, checked in a single pass."""
+    return compile_keypath_matcher(templates).matching(specific)
+
 
 if __name__ == '__main__':
     import inspect
@@ -227,6 +427,24 @@ if __name__ == '__main__':
     shouldnt(lambda: match_keypath("list[i]", "list.items"))
     shouldnt(lambda: match_keypath("list[i][j]", "list[2]"))
 
+    # # Tests for KeyPathTemplate
+    should(lambda: compile_keypath_template("list[i].item").matches("list[2].item.name"))
+    should(lambda: compile_keypath_template("list[i].item").matches(["list", 2, "item"]))
+    shouldnt(lambda: compile_keypath_template("list[i].item").matches(["list", "2", "item"]))
+    should(lambda: compile_keypath_template("list[i]") is compile_keypath_template("list[i]"))
+    should(["list[i]", "list[i].item"], lambda: match_keypaths(["list[i]", "foo", "list[i].item"], "list[0].item"))
+
+    # # Tests for KeyPathMatcher
+    should(lambda: KeyPathMatcher(["foo", "list[i].item"]).matches("list[2].item.name"))
+    should(lambda: KeyPathMatcher([""]).matches("anything"))
+    shouldnt(lambda: KeyPathMatcher(["foo", "list[i].item"]).matches("list[j].item"))
+    matcher = KeyPathMatcher(["list[i]"])
+    should(lambda: matcher.is_dead(matcher.advance_key(matcher.start, "other")))
+    shouldnt(lambda: matcher.is_match(matcher.advance_key(matcher.start, "list")))
+    for number in range(2 * MATCHER_TRANSITIONS_MAXSIZE):
+        matcher.advance_key(matcher.start, f"key{number}")
+    should(lambda: len(matcher._transitions) <= MATCHER_TRANSITIONS_MAXSIZE)
+
     print("".join(tests))
     if not any(test == "\033[91mF\033[0m" for test in tests):
         print("\033[92mAssertions passed\033[0m")
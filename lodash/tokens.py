@@ -1,16 +1,47 @@
+import codecs
+import heapq
 import json
-from typing import Any
+import threading
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncIterable, AsyncIterator, Iterable
+
+import json5
 import tiktoken
-import json5 as json
+
+from lodash.dict_manipulation import CUT_OFF_PLACEHOLDER
+from lodash.string_manipulation import match_keypath, split_keypath, truncate_string
+
+BATCH_SIZE = 1024
+
+_encodings: dict[str, tiktoken.core.Encoding] = {}
+_encodings_lock = threading.Lock()
 
 
 def __get_encoding(model: str) -> tiktoken.core.Encoding:
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+
+    with _encodings_lock:
+        encoding = _encodings.get(model)
+        if encoding is None:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+            _encodings[model] = encoding
     return encoding
 
+
+def warm_up_encodings(*models: str) -> None:
+    """
+    Loads the tiktoken encodings of the given models into the process-wide registry,
+    so that the first token count of a request doesn't pay for reading the BPE files.
+    """
+    for model in models:
+        __get_encoding(model)
+
 def __additional_tokens(model: str) -> tuple[int, int]:
     if model in {
         "gpt-3.5-turbo-0613",
@@ -77,48 +108,472 @@ def calculate_tokens_for(value: Any, model: str, with_name: bool = False) -> int
     if with_name:
         num_tokens += tokens_per_name
 
-    if isinstance(value, dict) or isinstance(value, list):
-        value = json.dumps(value)
-
-    num_tokens += len(encoding.encode(str(value))) if value else 0
+    value = _value_to_text(value)
+    num_tokens += len(encoding.encode(value)) if value else 0
     num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
     return num_tokens
 
 
-def _try_extract_usage_from_stream(stream_items: list[str]):
+def _value_to_text(value: Any) -> str:
+    if isinstance(value, dict) or isinstance(value, list):
+        value = json5.dumps(value)
+    return str(value) if value else ""
+
+
+def _count_batch(model: str, texts: list[str], num_threads: int) -> list[int]:
+    if not texts:
+        return []
+    encoding = __get_encoding(model)
+    return [len(tokens) for tokens in encoding.encode_batch(texts, num_threads=num_threads)]
+
+
+def _count_batch_in_process(model: str, texts: list[str]) -> list[int]:
+    return _count_batch(model, texts, num_threads=1)
+
+
+def calculate_tokens_for_many(
+        values: Iterable[Any],
+        model: str,
+        with_name: bool = False,
+        num_threads: int = 8,
+        batch_size: int = BATCH_SIZE,
+        process_pool: ProcessPoolExecutor | None = None
+) -> list[int]:
+    """
+    Counts tokens for many values at once, in the same way as `calculate_tokens_for`.
+
+    Args:
+        values: the values to count; dicts and lists are serialized like in `calculate_tokens_for`.
+        model: the model whose encoding and message overheads are used.
+        with_name: whether every value is a named message.
+        num_threads: the number of threads tiktoken uses to encode a batch.
+        batch_size: the number of values encoded per batch.
+        process_pool: when given, batches are encoded in this process pool instead of threads.
+
+    Returns:
+        The token counts, in the order of `values`.
+    """
+    tokens_per_message, tokens_per_name = __additional_tokens(model)
+    overhead = tokens_per_message + (tokens_per_name if with_name else 0) + 3
+
+    texts = [_value_to_text(value) for value in values]
+    non_empty = [index for index, text in enumerate(texts) if text]
+    batches = [
+        [texts[index] for index in non_empty[start:start + batch_size]]
+        for start in range(0, len(non_empty), batch_size)
+    ]
+
+    if process_pool is not None:
+        futures = [process_pool.submit(_count_batch_in_process, model, batch) for batch in batches]
+        batch_counts = [future.result() for future in futures]
+    else:
+        batch_counts = [_count_batch(model, batch, num_threads) for batch in batches]
+
+    counts = [overhead] * len(texts)
+    for index, count in zip(non_empty, (count for batch in batch_counts for count in batch)):
+        counts[index] += count
+    return counts
+
+
+def _loads_event(payload: str) -> Any:
     try:
-        res = json.loads(stream_items[-2])
-        usage = res["usage"]
-        return usage["prompt_tokens"], usage["completion_tokens"], usage["total_tokens"]
-    except Exception:
-        return None
+        return json.loads(payload)
+    except ValueError:
+        return json5.loads(payload)
+
+
+class StreamingTokenCounter:
+    """
+    Counts the tokens of a streamed (SSE) completion while it arrives.
+
+    Raw chunks are fed as they come; every `data:` event is parsed once and only the
+    current unfinished line of the completion is kept in memory: text is encoded as soon
+    as a newline followed by non-whitespace is seen, which is always a tokenizer boundary.
+    A usage block sent by the provider takes precedence over the counted numbers.
+
+    Example:
+        counter = StreamingTokenCounter("gpt-4", input_messages)
+        async for chunk in counter.apassthrough(response.content.iter_any()):
+            ...
+        prompt_tokens, completion_tokens, total_tokens = counter.totals()
+    """
+
+    def __init__(self, model: str, input_messages: Any = None, strict: bool = False):
+        """
+        Args:
+            model: the model whose encoding is used when no usage block is sent.
+            input_messages: the prompt, counted with `calculate_tokens_for` if needed.
+            strict: raise on events which can't be parsed instead of skipping them.
+        """
+        self.model = model
+        self.input_messages = input_messages
+        self.strict = strict
+        self.usage: tuple[int, int, int] | None = None
+        self.done = False
+        self.malformed_events = 0
+        self._prompt_tokens: int | None = None
+        self._completion_tokens = 0
+        # text not counted yet, as received
+        self._pending_text: list[str] = []
+        self._has_text = False
+        self._line = ""
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def feed(self, chunk: str | bytes) -> None:
+        """Feeds a raw chunk of the SSE stream; events may be split across chunks."""
+        if isinstance(chunk, bytes):
+            chunk = self._decoder.decode(chunk)
+        lines = (self._line + chunk).split("\n")
+        self._line = lines.pop()
+        for line in lines:
+            self._feed_line(line)
+
+    def close(self) -> None:
+        """Flushes an unterminated last line; called by the consuming helpers."""
+        tail = self._line + self._decoder.decode(b"", final=True)
+        self._line = ""
+        if tail:
+            self._feed_line(tail)
+
+    def _feed_line(self, line: str) -> None:
+        line = line.rstrip("\r")
+        if line.startswith("data:"):
+            self.add_event(line[5:])
+
+    def add_event(self, payload: str) -> None:
+        """Handles the payload of a single `data:` event."""
+        payload = payload.strip()
+        if not payload:
+            return
+        if payload == "[DONE]":
+            self.done = True
+            return
+
+        try:
+            event = _loads_event(payload)
+        except Exception:
+            if self.strict:
+                raise
+            self.malformed_events += 1
+            return
+        if not isinstance(event, dict):
+            return
+
+        usage = event.get("usage")
+        if isinstance(usage, dict):
+            try:
+                self.usage = usage["prompt_tokens"], usage["completion_tokens"], usage["total_tokens"]
+            except KeyError:
+                pass
+
+        choices = event.get("choices")
+        if choices:
+            content = (choices[0].get("delta") or {}).get("content")
+            if content:
+                self._add_text(content)
+
+    def _add_text(self, text: str) -> None:
+        self._has_text = True
+        pending = self._pending_text
+        # every pending newline but a trailing one is followed by whitespace, or the text would
+        # have been counted up to it, so only the new text and the character before it are searched
+        before = pending[-1][-1:] if pending else ""
+        window = before + text
+        boundary = len(window)
+        while True:
+            boundary = window.rfind("\n", 0, boundary)
+            if boundary < 0:
+                if text:
+                    pending.append(text)
+                return
+            if boundary + 1 < len(window) and not window[boundary + 1].isspace():
+                break
+        cut = boundary + 1 - len(before)
+        pending.append(text[:cut])
+        self._completion_tokens += calculate_tokens_for_string("".join(pending), self.model)
+        pending.clear()
+        if cut < len(text):
+            pending.append(text[cut:])
+
+    @property
+    def prompt_tokens(self) -> int:
+        if self.usage is not None:
+            return self.usage[0]
+        if self._prompt_tokens is None:
+            self._prompt_tokens = calculate_tokens_for(self.input_messages, self.model)
+        return self._prompt_tokens
+
+    @property
+    def completion_tokens(self) -> int:
+        if self.usage is not None:
+            return self.usage[1]
+        if not self._has_text:
+            return calculate_tokens_for_string("", self.model)
+        if not self._pending_text:
+            return self._completion_tokens
+        return self._completion_tokens + calculate_tokens_for_string("".join(self._pending_text), self.model)
+
+    @property
+    def total_tokens(self) -> int:
+        if self.usage is not None:
+            return self.usage[2]
+        return self.prompt_tokens + self.completion_tokens
+
+    def totals(self) -> tuple[int, int, int]:
+        return self.prompt_tokens, self.completion_tokens, self.total_tokens
+
+    def consume(self, chunks: Iterable[str | bytes]) -> tuple[int, int, int]:
+        for chunk in chunks:
+            self.feed(chunk)
+        self.close()
+        return self.totals()
+
+    async def aconsume(self, chunks: AsyncIterable[str | bytes]) -> tuple[int, int, int]:
+        async for chunk in chunks:
+            self.feed(chunk)
+        self.close()
+        return self.totals()
+
+    async def apassthrough(self, chunks: AsyncIterable[str | bytes]) -> AsyncIterator[str | bytes]:
+        """Yields the chunks unchanged while counting them."""
+        async for chunk in chunks:
+            self.feed(chunk)
+            yield chunk
+        self.close()
 
 
 def count_streaming_tokens(input_messages, response_string: str, model: str) -> tuple[int, int, int]:
+    counter = StreamingTokenCounter(model, input_messages, strict=True)
+    for item in response_string.split("data: "):
+        counter.add_event(item)
+    return counter.totals()
+
+
+def _collect_budget_nodes(data) -> tuple[list, list, list, list]:
+    values, paths, segments, parents = [data], [""], [()], [-1]
+    stack = [0]
+    while stack:
+        index = stack.pop()
+        value = values[index]
+        if isinstance(value, dict):
+            children = (
+                (f"{paths[index]}.{key}" if paths[index] else str(key), key, child)
+                for key, child in value.items()
+            )
+        elif isinstance(value, list):
+            children = ((f"{paths[index]}[{i}]", i, child) for i, child in enumerate(value))
+        else:
+            continue
+        for path, key, child in children:
+            stack.append(len(values))
+            values.append(child)
+            paths.append(path)
+            segments.append(segments[index] + (key,))
+            parents.append(index)
+    return values, paths, segments, parents
+
+
+def _budget_costs(encoding: tiktoken.core.Encoding, values: list, segments: list, parents: list[int]) -> list[int]:
+    # serializes the payload once, remembering the span of every node, and attributes
+    # every token to the nodes its first character belongs to
+    children = [[] for _ in values]
+    for index in range(1, len(values)):
+        children[parents[index]].append(index)
+
+    parts, starts, ends = [], [0] * len(values), [0] * len(values)
+    position = 0
+    stack: list[tuple[int, Any]] = [(0, 0)]
+    while stack:
+        kind, item = stack.pop()
+        if kind == 1:
+            parts.append(item)
+            position += len(item)
+        elif kind == 2:
+            ends[item] = position
+        elif isinstance(values[item], (dict, list)):
+            is_dict = isinstance(values[item], dict)
+            starts[item] = position
+            sequence = [(1, "{" if is_dict else "[")]
+            for number, child in enumerate(children[item]):
+                if number:
+                    sequence.append((1, ", "))
+                if is_dict:
+                    sequence.append((1, json.dumps(str(segments[child][-1])) + ": "))
+                sequence.append((0, child))
+            sequence.append((1, "}" if is_dict else "]"))
+            sequence.append((2, item))
+            stack.extend(reversed(sequence))
+        else:
+            text = json.dumps(values[item], default=str)
+            starts[item] = position
+            parts.append(text)
+            position += len(text)
+            ends[item] = position
+
+    _, offsets = encoding.decode_with_offsets(encoding.encode_ordinary("".join(parts)))
+    return [bisect_left(offsets, end) - bisect_left(offsets, start) for start, end in zip(starts, ends)]
+
+
+def _budget_priorities(paths: list[str], parents: list[int], priorities: dict[str, int]) -> list[int]:
+    # a template matches every path it is a prefix of, so a node only has to check the
+    # templates longer than its parent's path and otherwise inherits the parent's priority
+    templates = sorted(
+        ((len(split_keypath(template)), priority, template) for template, priority in priorities.items()),
+        reverse=True
+    )
+    part_counts = [0] * len(paths)
+    result = [max((priority for length, priority, _ in templates if length == 0), default=0)] * len(paths)
+    for index in range(1, len(paths)):
+        parent = parents[index]
+        count = part_counts[index] = len(split_keypath(paths[index]))
+        result[index] = result[parent]
+        for length, priority, template in templates:
+            if part_counts[parent] < length <= count and match_keypath(template, paths[index]):
+                result[index] = priority
+                break
+    return result
+
 
-    stream_items = response_string.split("data: ")
-
-    stream_results = []
-    for item in stream_items:
-        if item and item.strip() != "[DONE]":
-            stream_results.append(json.loads(item))
-    text_for_count_completion = "".join(
-        [item["choices"][0]["delta"].get("content", "") for item in stream_results if
-         item.get("choices", [])])
-    res = _try_extract_usage_from_stream(stream_items)
-    if res is not None:
-        prompt_tokens, completion_tokens, total_tokens = res
-        return prompt_tokens, completion_tokens, total_tokens
+def fit_to_token_budget(
+        data: Any,
+        model: str,
+        budget: int | None = None,
+        priorities: dict[str, int] | None = None,
+        max_length: int = 120,
+        symbols: str = "..."
+) -> tuple[Any, dict]:
+    """
+    Shrinks a payload until `calculate_tokens_for` of it fits into the budget.
+
+    Token costs of all subtrees are computed once; every change only updates the costs of
+    its ancestors and the payload is recounted for real only when the estimate fits.
+    First long strings are truncated (like `cut_up_values`), then whole fields are replaced
+    with `CUT_OFF_PLACEHOLDER` (like `truncate_fields_from_focused_out_fields`), each time
+    lowest priority and largest saving first. The input is never modified.
+
+    Args:
+        data: the payload, usually a dict or a list.
+        model: the model to count tokens for.
+        budget: the number of tokens to fit into, `maximum_context_tokens(model)` by default.
+        priorities: keypath templates (as in `match_keypath`) mapped to priorities; a field
+            takes the priority of its most specific template, 0 by default. A field is cut
+            off only as late as its most important descendant.
+        max_length: the length long strings are truncated to.
+        symbols: the symbols marking a truncated string.
+
+    Returns:
+        The fitted payload and a report:
+        {"budget", "tokens_before", "tokens_after", "fits", "truncated": [...], "cut_off": [...]}.
+    """
+    if budget is None:
+        budget = maximum_context_tokens(model)
+
+    tokens = calculate_tokens_for(data, model)
+    report = {
+        "budget": budget,
+        "tokens_before": tokens,
+        "tokens_after": tokens,
+        "fits": tokens <= budget,
+        "truncated": [],
+        "cut_off": [],
+    }
+    if tokens <= budget:
+        return data, report
+
+    encoding = __get_encoding(model)
+    values, paths, segments, parents = _collect_budget_nodes(data)
+    node_priorities = _budget_priorities(paths, parents, priorities or {})
+
+    costs = _budget_costs(encoding, values, segments, parents)
+
+    keep_priorities = list(node_priorities)
+    for index in range(len(values) - 1, 0, -1):
+        parent = parents[index]
+        keep_priorities[parent] = max(keep_priorities[parent], keep_priorities[index])
+
+    placeholder_cost = len(encoding.encode(json5.dumps(CUT_OFF_PLACEHOLDER)))
+    replacements: dict[int, Any] = {}
+    cut_off: set[int] = set()
+
+    def _is_cut_off(index: int) -> bool:
+        while index != -1:
+            if index in cut_off:
+                return True
+            index = parents[index]
+        return False
+
+    def _actions():
+        truncatable = [
+            index for index in range(1, len(values))
+            if isinstance(values[index], str) and len(values[index]) > max_length
+        ]
+        truncated = [
+            truncate_string(values[index], max_length=max_length, symbols=symbols, position='brackets')
+            for index in truncatable
+        ]
+        truncated_costs = [len(tokens) for tokens in encoding.encode_batch([json5.dumps(text) for text in truncated])]
+        order = sorted(
+            range(len(truncatable)),
+            key=lambda i: (node_priorities[truncatable[i]], truncated_costs[i] - costs[truncatable[i]])
+        )
+        for i in order:
+            if truncated_costs[i] < costs[truncatable[i]]:
+                yield truncatable[i], truncated[i], truncated_costs[i]
+
+        heap = [(keep_priorities[index], -costs[index], index) for index in range(1, len(values))]
+        heapq.heapify(heap)
+        while heap:
+            priority, cost, index = heapq.heappop(heap)
+            if costs[index] <= placeholder_cost or _is_cut_off(index):
+                continue
+            if -cost != costs[index]:
+                heapq.heappush(heap, (priority, -costs[index], index))
+                continue
+            cut_off.add(index)
+            yield index, CUT_OFF_PLACEHOLDER, placeholder_cost
+
+    def _build():
+        # copy-on-write by node index, so raw keys (like "") are never read as keypath syntax
+        copies: dict[int, Any] = {}
+
+        def _own(index: int):
+            chain = []
+            while index != -1 and index not in copies:
+                chain.append(index)
+                index = parents[index]
+            for node in reversed(chain):
+                copies[node] = values[node].copy()
+                if parents[node] != -1:
+                    copies[parents[node]][segments[node][-1]] = copies[node]
+            return copies[chain[0]] if chain else copies[index]
+
+        for index, replacement in replacements.items():
+            if not _is_cut_off(parents[index]):
+                _own(parents[index])[segments[index][-1]] = replacement
+        return copies.get(0, data)
+
+    result = data
+    for index, replacement, cost in _actions():
+        replacements[index] = replacement
+        saving = costs[index] - cost
+        tokens -= saving
+        parent = index
+        while parent != -1:
+            costs[parent] -= saving
+            parent = parents[parent]
+        if tokens <= budget:
+            result = _build()
+            tokens = calculate_tokens_for(result, model)
+            if tokens <= budget:
+                break
     else:
-        res = []
-        for item in stream_items:
-            if item and item.strip() != "[DONE]":
-                res.append(json.loads(item))
-        stream_items = res
-        text_for_count_completion = "".join(
-            [item["choices"][0]["delta"].get("content", "") for item in stream_items if
-             item.get("choices", [])])
-        prompt_tokens = calculate_tokens_for(input_messages, model)
-        completion_tokens = calculate_tokens_for_string(text_for_count_completion, model)
-        total_tokens = prompt_tokens + completion_tokens
-        return prompt_tokens, completion_tokens, total_tokens
+        if replacements:
+            result = _build()
+            tokens = calculate_tokens_for(result, model)
+
+    applied = [index for index in replacements if not _is_cut_off(parents[index])]
+    report["tokens_after"] = tokens
+    report["fits"] = tokens <= budget
+    report["truncated"] = [paths[index] for index in applied if index not in cut_off]
+    report["cut_off"] = [paths[index] for index in applied if index in cut_off]
+    return result, report
@@ -0,0 +1,248 @@
+from typing import Any, Callable, Iterator, NamedTuple
+
+# A path is a linked tuple `(parent_path, key, is_index)`: `key` is the dict key or the list
+# index of the node (None for set items). The root's path is `(None, prefix, None)`, where
+# `prefix` is the keypath of the walked data in a bigger document. Paths cost one tuple per
+# node; `path_segments` and `path_to_keypath` build more only when asked for.
+Path = tuple
+
+ROOT_PATH: Path = (None, "", None)
+
+
+def root_path(prefix: str = "") -> Path:
+    """The path of a walked root which itself is located at the keypath `prefix`."""
+    return (None, prefix, None)
+
+
+def path_segments(path: Path) -> tuple:
+    """The keys and indexes from the root down to the node."""
+    segments = []
+    while path[2] is not None:
+        path, key, _ = path
+        segments.append(key)
+    return tuple(reversed(segments))
+
+
+def path_to_keypath(path: Path) -> str:
+    """The keypath of the node, like "a.b[0]", after the prefix of the root."""
+    links = []
+    while path[2] is not None:
+        links.append(path)
+        path = path[0]
+    keypath = path[1]
+    for _, key, is_index in reversed(links):
+        if is_index:
+            keypath = f"{keypath}[{key}]"
+        else:
+            keypath = f"{keypath}.{key}" if keypath else str(key)
+    return keypath
+
+
+class Prune(NamedTuple):
+    """Returned by a `transform` visitor to put `value` in place of a node without walking into it."""
+    value: Any
+
+
+class _Drop:
+    __slots__ = ()
+
+    def __repr__(self):
+        return "DROP"
+
+
+# returned by a `transform` visitor to leave the node out of its dict or list
+DROP = _Drop()
+
+
+def walk(
+        data: Any,
+        prune: Callable[[Path, Any], bool] | None = None,
+        types: tuple[type, ...] = (dict, list),
+        path: Path = ROOT_PATH,
+        leaves: bool = True
+) -> Iterator[tuple[Path, Any]]:
+    """
+    Lazily yields `(path, value)` for every node of nested dicts and lists (or other `types`),
+    parents before their children, in the order of their items.
+
+    The walk is iterative, so deep data doesn't hit the recursion limit. A container's items
+    are read after it was yielded, so it may be changed in between. With `prune(path, value)`
+    returning True, the walk doesn't go into that container. `path` locates `data` in a
+    bigger document, see `root_path`. Without `leaves`, only the containers are yielded,
+    which is much faster.
+
+    Example:
+        for path, value in walk(document):
+            if isinstance(value, dict) and value.get("$uid") == uid:
+                return path_to_keypath(path)
+    """
+    yield path, data
+    if not isinstance(data, types) or (prune is not None and prune(path, data)):
+        return
+
+    # a stack of (path, items, is_index) for the containers being walked
+    stack = [(path, *_items(data))]
+    while stack:
+        parent, items, is_index = stack[-1]
+        for key, value in items:
+            if isinstance(value, types):
+                path = (parent, key, is_index)
+                yield path, value
+                if prune is None or not prune(path, value):
+                    stack.append((path, *_items(value)))
+                    break
+            elif leaves:
+                yield (parent, key, is_index), value
+        else:
+            stack.pop()
+
+
+def _items(container) -> tuple[Iterator, bool | None]:
+    if isinstance(container, dict):
+        return iter(container.items()), False
+    if isinstance(container, (list, tuple)):
+        return enumerate(container), True
+    return ((None, item) for item in container), None
+
+
+def iter_containers(data: Any, types: tuple[type, ...] = (dict, list)) -> Iterator[Any]:
+    """
+    Lazily yields `data` and every container of `types` nested in it, like `walk` without
+    leaves and paths, which makes it the fastest way to visit every dict of a document.
+    """
+    yield data
+    if not isinstance(data, types):
+        return
+    stack = [iter(data.values()) if isinstance(data, dict) else iter(data)]
+    while stack:
+        for value in stack[-1]:
+            if isinstance(value, types):
+                yield value
+                stack.append(iter(value.values()) if isinstance(value, dict) else iter(value))
+                break
+        else:
+            stack.pop()
+
+
+def transform(
+        data: Any,
+        visit: Callable[[Path, Any], Any] | None = None,
+        *,
+        leaves: bool = True,
+        omit: frozenset | set = frozenset(),
+        in_place: bool = False,
+        types: tuple[type, ...] = (dict, list),
+        path: Path = ROOT_PATH
+) -> Any:
+    """
+    Rebuilds nested dicts and lists (or other `types`) top-down, without recursion.
+
+    `visit(path, value)` is called for every node, parents before their children, and returns
+    what goes in its place: a container of `types` is walked into in turn, `Prune(value)` puts
+    `value` without walking into it and `DROP` leaves the node out of its parent. Without
+    `leaves`, only containers are visited and everything else is kept as is, which is much
+    faster. Keys in `omit` are left out of every dict. Without `visit`, the containers are
+    copied. Containers are rebuilt as new dicts, lists, tuples or sets; with `in_place`,
+    dicts and lists are changed in place instead and returned.
+
+    Example:
+        without_secrets = transform(config, omit={"password"})
+    """
+    value = data if visit is None else visit(path, data)
+    if type(value) is Prune:
+        return value.value
+    if value is DROP:
+        return None
+    if not isinstance(value, types):
+        return value
+
+    # Containers are queued with the slot of their parent's copy; once taken from the queue, a
+    # container is copied (as a list for tuples and sets) into that slot and its items visited.
+    # Dropped list items are marked with DROP and removed once everything is done.
+    holder = [value]
+    pending = [(holder, 0, value, path)]
+    rebuilt = []
+    dropping = {}
+    while pending:
+        owner, owner_slot, value, parent = pending.pop()
+        if isinstance(value, dict):
+            container, is_index = value if in_place else dict(value), False
+            if omit:
+                for key in omit:
+                    container.pop(key, None)
+            items = container.items()
+        else:
+            if isinstance(value, list):
+                container, is_index = value if in_place else list(value), True
+            else:
+                container, is_index = list(value), True if isinstance(value, tuple) else None
+                cls = tuple if is_index else frozenset if isinstance(value, frozenset) else set
+                rebuilt.append((owner, owner_slot, cls))
+            items = enumerate(container)
+        if container is not value:
+            owner[owner_slot] = container
+
+        if visit is None:
+            for slot, child in items:
+                if isinstance(child, types):
+                    pending.append((container, slot, child, None))
+            continue
+
+        dropped = None
+        for slot, child in items:
+            if isinstance(child, types):
+                child_path = (parent, slot, is_index) if is_index is not None else (parent, None, None)
+                put = visit(child_path, child)
+                if put is child:
+                    pending.append((container, slot, child, child_path))
+                    continue
+            elif leaves:
+                child_path = (parent, slot, is_index) if is_index is not None else (parent, None, None)
+                put = visit(child_path, child)
+                if put is child:
+                    continue
+            else:
+                continue
+
+            if put is DROP:
+                if dropped is None:
+                    dropped = []
+                dropped.append(slot)
+            elif type(put) is Prune:
+                container[slot] = put.value
+            else:
+                container[slot] = put
+                if isinstance(put, types):
+                    pending.append((container, slot, put, child_path))
+        if dropped is not None:
+            if is_index is False:
+                for key in dropped:
+                    del container[key]
+            else:
+                for index in dropped:
+                    container[index] = DROP
+                dropping[id(container)] = container
+
+    # children were queued after their parents, so they are rebuilt first
+    for container, slot, cls in reversed(rebuilt):
+        items = container[slot]
+        container[slot] = cls([item for item in items if item is not DROP] if id(items) in dropping else items)
+    for items in dropping.values():
+        items[:] = [item for item in items if item is not DROP]
+    return holder[0]
+
+
+if __name__ == '__main__':
+    doc = {"a": [{"$uid": "1", "b": 2}, 3], "$uid": "0"}
+    assert [path_to_keypath(path) for path, _ in walk(doc)] == ["", "a", "a[0]", "a[0].$uid", "a[0].b", "a[1]", "$uid"]
+    assert [path_segments(path) for path, _ in walk(doc, leaves=False)] == [(), ("a",), ("a", 0)]
+    assert path_to_keypath(list(walk(doc, path=root_path("root")))[3][0]) == "root.a[0].$uid"
+    assert transform(doc, omit={"$uid"}) == {"a": [{"b": 2}, 3]} and "$uid" in doc
+    assert transform(doc, lambda path, value: Prune("-") if path[1] == "a" else value) == {"a": "-", "$uid": "0"}
+    assert transform([1, 2, 3, 4], lambda path, value: DROP if path[2] and value % 2 else value, in_place=True) == [2, 4]
+    deep = []
+    for _ in range(10000):
+        deep = [deep]
+    copied = transform(deep)
+    assert copied is not deep and sum(1 for _ in walk(copied)) == sum(1 for _ in walk(deep)) == 10001
+    print("Assertions passed")